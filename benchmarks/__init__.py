@@ -0,0 +1,3 @@
+"""
+Benchmarks of the pipeline steps on synthetic data, run with python -m benchmarks.run
+"""
@@ -0,0 +1,194 @@
+"""
+Synthetic incidents, street grid and community areas at Chicago scale, so the pipeline can be timed without the data portal.
+"""
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from street_segment.config import INC_SCHEMA
+
+# CPD offense categories by IUCR code, primary type and description, the offense mix is drawn from them
+OFFENSE_LOOKUP = Path(__file__).parent / 'cpd_offense_lookup.csv'
+
+# rough share of each primary type among Chicago incidents since 2014, the other primary types split what is left
+PRIMARY_TYPE_SHARES = {
+    'THEFT': 0.22,
+    'BATTERY': 0.185,
+    'CRIMINAL DAMAGE': 0.105,
+    'ASSAULT': 0.075,
+    'DECEPTIVE PRACTICE': 0.065,
+    'OTHER OFFENSE': 0.062,
+    'MOTOR VEHICLE THEFT': 0.055,
+    'NARCOTICS': 0.045,
+    'BURGLARY': 0.04,
+    'ROBBERY': 0.035,
+    'WEAPONS VIOLATION': 0.025,
+    'CRIMINAL TRESPASS': 0.022,
+}
+
+# south-west corner of the synthetic city in EPSG:26916, so the grid falls within CITY_BOUNDS
+ORIGIN = (424000.0, 4614000.0)
+
+# a 165 by 165 grid of 200 metre blocks has about as many segments as Chicago's street network, about 55,000
+BLOCKS = 165
+BLOCK_SIZE = 200.0
+
+# community areas laid out as a 7 by 11 grid over the blocks, 77 like Chicago's
+COMMUNITY_GRID = (7, 11)
+
+# police beats laid out as a 15 by 18 grid over the blocks, about as many as Chicago's 274
+BEAT_GRID = (15, 18)
+
+
+def offense_mix(lookup_path = OFFENSE_LOOKUP):
+
+    """
+    Weighting every offense in the CPD lookup by how common its primary type is; returns dataframe of iucr, primary_type, description and weight.
+    lookup_path: csv of CPD offense categories by IUCR code, primary type and description
+    """
+
+    lookup = pd.read_csv(lookup_path, encoding='utf-8-sig', dtype=str)
+    lookup = lookup.rename(columns={'IUCR': 'iucr', 'PrimaryType': 'primary_type', 'Description': 'description'})
+    lookup['iucr'] = lookup['iucr'].str.zfill(4)
+
+    rest = [t for t in lookup['primary_type'].unique() if t not in PRIMARY_TYPE_SHARES]
+    shares = {**PRIMARY_TYPE_SHARES, **{t: (1 - sum(PRIMARY_TYPE_SHARES.values())) / len(rest) for t in rest}}
+
+    # descriptions within a primary type are equally likely
+    lookup['weight'] = lookup['primary_type'].map(shares) / lookup.groupby('primary_type')['primary_type'].transform('size')
+
+    return lookup[['iucr', 'primary_type', 'description', 'weight']]
+
+
+def synthetic_streets(blocks = BLOCKS, block_size = BLOCK_SIZE):
+
+    """
+    Laying out a grid of street segments, one per block edge; returns geopandas dataframe shaped like street_network_read.
+    blocks: number of blocks along each side of the grid
+    block_size: length of a block in metres
+    """
+
+    x0, y0 = ORIGIN
+    i, j = np.meshgrid(np.arange(blocks + 1), np.arange(blocks), indexing='ij')
+    i, j = i.ravel(), j.ravel()
+
+    # north-south segments along each avenue, then east-west segments along each street
+    starts = np.concatenate([np.column_stack([x0 + i * block_size, y0 + j * block_size]),
+                             np.column_stack([x0 + j * block_size, y0 + i * block_size])])
+    ends = starts + np.concatenate([np.tile([0.0, block_size], (len(i), 1)), np.tile([block_size, 0.0], (len(i), 1))])
+    lines = shapely.linestrings(np.stack([starts, ends], axis=1))
+
+    n = len(lines)
+    north_south = np.arange(n) < len(i)
+    line_no = np.concatenate([i, i])
+    street = gpd.GeoDataFrame({
+        'trans_id': np.arange(n) + 100000,
+        'pre_dir': np.where(north_south, 'N', 'W'),
+        'street_nam': np.char.add(np.where(north_south, 'AVENUE ', 'STREET '), line_no.astype(str)),
+        'street_typ': np.where(north_south, 'AVE', 'ST'),
+        'logiclf': (np.concatenate([j, j]) * 100).astype(str),
+    }, geometry=lines, crs='EPSG:26916')
+
+    return street
+
+
+def synthetic_communities(blocks = BLOCKS, block_size = BLOCK_SIZE, grid = COMMUNITY_GRID):
+
+    """
+    Splitting the street grid into rectangular community areas; returns geopandas dataframe shaped like import_chi_boundaries.
+    blocks: number of blocks along each side of the street grid
+    block_size: length of a block in metres
+    grid: number of community areas across and up the grid
+    """
+
+    x0, y0 = ORIGIN
+    width, height = blocks * block_size / grid[0], blocks * block_size / grid[1]
+    col, row = np.meshgrid(np.arange(grid[0]), np.arange(grid[1]), indexing='ij')
+    col, row = col.ravel(), row.ravel()
+
+    com = gpd.GeoDataFrame({
+        'area_num_1': (col * grid[1] + row + 1).astype(str),
+        'community': [f'COMMUNITY {k + 1}' for k in range(len(col))],
+    }, geometry=shapely.box(x0 + col * width, y0 + row * height, x0 + (col + 1) * width, y0 + (row + 1) * height),
+        crs='EPSG:26916')
+
+    return com
+
+
+def synthetic_beats(blocks = BLOCKS, block_size = BLOCK_SIZE, grid = BEAT_GRID):
+
+    """
+    Splitting the street grid into rectangular police beats; returns geopandas dataframe shaped like import_chi_boundaries.
+    blocks: number of blocks along each side of the street grid
+    block_size: length of a block in metres
+    grid: number of beats across and up the grid
+    """
+
+    beat = synthetic_communities(blocks, block_size, grid)
+    beat['beat_num'] = (pd.to_numeric(beat['area_num_1']) + 100).astype(str)
+
+    return beat[['beat_num', 'geometry']]
+
+
+def synthetic_incidents(n, seed = 0, years = (2014, 2024), blocks = BLOCKS, block_size = BLOCK_SIZE,
+                        grid = COMMUNITY_GRID, lookup_path = OFFENSE_LOOKUP):
+
+    """
+    Drawing incidents over the street grid with the offense mix of the CPD lookup; returns pandas dataframe with the dtypes of the incident store.
+    n: number of incidents
+    seed: seed of the random draws, the same seed gives the same incidents
+    years: first and last year the incident dates are drawn from
+    blocks: number of blocks along each side of the street grid
+    block_size: length of a block in metres
+    grid: number of community areas across and up the grid, as in synthetic_communities
+    lookup_path: csv of CPD offense categories by IUCR code, primary type and description
+    """
+
+    rng = np.random.default_rng(seed)
+    mix = offense_mix(lookup_path)
+    offense = rng.choice(len(mix), size=n, p=(mix['weight'] / mix['weight'].sum()).values)
+
+    start = pd.Timestamp(f'{years[0]}-01-01')
+    span = int((pd.Timestamp(f'{years[1] + 1}-01-01') - start).total_seconds())
+    dates = start + pd.to_timedelta(rng.integers(0, span, n), unit='s')
+
+    # points anywhere on the grid, most of them a few metres off a street as geocoded blocks are
+    extent = blocks * block_size
+    x = rng.random(n) * extent
+    y = rng.random(n) * extent
+    on_avenue = rng.random(n) < 0.5
+    x = np.where(on_avenue, np.round(x / block_size) * block_size + rng.normal(0, 10, n), x).clip(0, extent)
+    y = np.where(on_avenue, y, np.round(y / block_size) * block_size + rng.normal(0, 10, n)).clip(0, extent)
+    community_area = ((x / (extent / grid[0])).astype(int).clip(0, grid[0] - 1) * grid[1]
+                      + (y / (extent / grid[1])).astype(int).clip(0, grid[1] - 1) + 1)
+
+    # the feed gives latitude and longitude, incidents_to_gdf projects them back, and state plane coordinates in feet
+    points = gpd.GeoSeries(gpd.points_from_xy(x + ORIGIN[0], y + ORIGIN[1]), crs='EPSG:26916')
+    state_plane = points.to_crs('EPSG:3435')
+    points = points.to_crs('EPSG:4326')
+
+    inc = pd.DataFrame({
+        'id': np.arange(n) + 10_000_000,
+        'case_number': 'J' + pd.Series(np.arange(n) + 1).astype('str').str.zfill(8),
+        'date': dates,
+        'iucr': mix['iucr'].values[offense],
+        'primary_type': mix['primary_type'].values[offense],
+        'description': mix['description'].values[offense],
+        'arrest': rng.random(n) < 0.18,
+        'domestic': rng.random(n) < 0.16,
+        'beat': rng.integers(111, 2535, n),
+        'district': rng.integers(1, 26, n),
+        'ward': rng.integers(1, 51, n),
+        'community_area': community_area,
+        'year': dates.year,
+        'updated_on': dates + pd.Timedelta(days=7),
+        'x_coordinate': state_plane.x.values,
+        'y_coordinate': state_plane.y.values,
+        'latitude': points.y.values,
+        'longitude': points.x.values,
+    })
+
+    return inc.astype(INC_SCHEMA)
@@ -0,0 +1,171 @@
+"""
+Timing the pipeline steps on synthetic incidents at several scales, e.g. python -m benchmarks.run --scales 10000 1000000 --baseline benchmarks/baseline.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import geopandas as gpd
+import pandas as pd
+import shapely
+
+from street_segment.aggregate import rollup_levels, summarize, summarize_cube, summarize_neighborhoods
+from street_segment.areas import area_lookup
+from street_segment.export import export_neighborhoods, export_rolling, export_rollup, export_seg, export_seg_time
+from street_segment.features import incident_features
+from street_segment.fetch import incidents_to_gdf
+from street_segment.metrics import RUN_STATE, measure, start_run
+from street_segment.pipeline import beat_layer, community_layer, street_layer
+from street_segment.rolling import cumulative_counts, month_counts, window_counts
+from street_segment.snap import join_segments, segment_index, street_version
+
+from .fixtures import BLOCKS, synthetic_beats, synthetic_communities, synthetic_incidents, synthetic_streets
+
+# steps reported for every scale, in the order they run
+BENCH_STEPS = ['incidents_to_gdf', 'offense_features', 'join_segments', 'summarize', 'rollup_levels', 'rolling',
+               'summarize_neighborhoods', 'export']
+
+
+def bench_scale(n, seed = 0, blocks = BLOCKS, workers = 1):
+
+    """
+    Running every benchmarked step once on n synthetic incidents; returns dictionary of wall time, throughput and peak memory by step.
+    n: number of incidents
+    seed: seed of the synthetic incidents
+    blocks: number of blocks along each side of the synthetic street grid
+    workers: number of processes the nearest-segment assignment is spread over
+    """
+
+    inc = synthetic_incidents(n, seed, blocks = blocks)
+    street, street1 = street_layer(synthetic_streets(blocks))
+    com1 = community_layer(synthetic_communities(blocks))
+    beat1 = beat_layer(synthetic_beats(blocks))
+
+    # metrics start after the fixtures are built, so the fixtures only show in peak memory
+    start_run()
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        tree = segment_index(street1, cache_dir = tmp)
+        key = street_version(street1)
+        areas = [area_lookup(com1, 'community_area', street1, key, cache_dir = tmp), area_lookup(beat1, 'beat', street1, key, cache_dir = tmp)]
+
+        inc1 = incident_features(incidents_to_gdf(inc))
+        isj_sub = join_segments(inc1, com1, street1, tree, workers = workers, areas = areas)
+
+        with measure('summarize', len(isj_sub)):
+            seg, seg_time = summarize(isj_sub, street1)
+        rollup = rollup_levels(seg_time, com1)
+        cube = summarize_cube(isj_sub)[0]
+        with measure('rolling', len(isj_sub)):
+            seg_rolling = window_counts(cumulative_counts(month_counts(cube)))
+        with measure('summarize_neighborhoods', len(isj_sub)):
+            neighborhood_summary = summarize_neighborhoods(isj_sub, com1)[0]
+        with measure('export', len(isj_sub)):
+            export_seg(seg, street, tmp / 'seg_summary.parquet')
+            export_seg_time(seg_time, street, tmp / 'seg_time.parquet')
+            export_neighborhoods(neighborhood_summary, tmp / 'neighborhood_summary.parquet')
+            export_rollup(rollup, tmp / 'rollup.parquet')
+            export_rolling(seg_rolling, tmp / 'seg_rolling.parquet')
+
+    results = {}
+    for record in RUN_STATE['steps']:
+        if record['step'] in BENCH_STEPS:
+            results[record['step']] = dict(
+                wall_s = record['wall_s'],
+                rows = record['rows_in'],
+                rows_per_s = round(record['rows_in'] / record['wall_s']) if record['wall_s'] else None,
+                peak_rss_mb = record['peak_rss_mb'],
+            )
+
+    return {step: results[step] for step in BENCH_STEPS if step in results}
+
+
+def environment():
+
+    """
+    Describing the machine and library versions the benchmarks ran on; returns dictionary.
+    """
+
+    return dict(
+        python = platform.python_version(),
+        platform = platform.platform(),
+        cpus = os.cpu_count(),
+        pandas = pd.__version__,
+        geopandas = gpd.__version__,
+        shapely = shapely.__version__,
+    )
+
+
+def compare(results, baseline, tolerance = 0.2):
+
+    """
+    Printing each step against the saved baseline; returns the list of scale and step pairs slower than the tolerance allows.
+    results: results by scale and step from bench_scale
+    baseline: results saved by an earlier run, or None
+    tolerance: fraction a step may be slower than its baseline before it counts as a regression
+    """
+
+    slower = []
+    for scale, steps in results.items():
+        for step, result in steps.items():
+            line = (f"{int(scale):>10,}  {step:<24} {result['wall_s']:>9.3f} s  {result['rows_per_s'] or 0:>12,} rows/s"
+                    f"  {result['peak_rss_mb']:>8.1f} MB")
+            before = (baseline or {}).get(scale, {}).get(step)
+            if before and before['wall_s']:
+                change = result['wall_s'] / before['wall_s'] - 1
+                line += f"  {change:+7.1%} vs baseline"
+                if change > tolerance:
+                    line += '  SLOWER'
+                    slower.append((scale, step))
+            print(line)
+
+    return slower
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog='benchmarks.run', description='Time the pipeline steps on synthetic incidents.')
+    parser.add_argument('--scales', type=int, nargs='+', default=[10000, 100000, 1000000], help='numbers of incidents to run at')
+    parser.add_argument('--blocks', type=int, default=BLOCKS, help='blocks along each side of the synthetic street grid')
+    parser.add_argument('--workers', type=int, default=1, help='processes used for the nearest-segment assignment')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic incidents')
+    parser.add_argument('--baseline', type=Path, default=Path('benchmarks/baseline.json'), help='results to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='save these results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='fraction a step may be slower than its baseline')
+    parser.add_argument('--check', action='store_true', help='exit with status 1 when a step is slower than its baseline allows')
+    parser.add_argument('--out', type=Path, help='json file to write these results to')
+    args = parser.parse_args(argv)
+
+    # every scale runs in a fresh process, so its peak memory is not the high-water mark of a larger scale before it
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for n in args.scales:
+        print(f'Benchmarking {n:,} incidents.')
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            results[str(n)] = pool.submit(bench_scale, n, args.seed, args.blocks, args.workers).result()
+
+    baseline = None
+    if args.baseline.exists():
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+    slower = compare(results, baseline, args.tolerance)
+
+    report = dict(environment = environment(), settings = dict(blocks = args.blocks, workers = args.workers, seed = args.seed),
+                  results = results)
+    for path in [args.out, args.baseline if args.save_baseline else None]:
+        if path is not None:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f'Results written to {path}.')
+
+    if args.check and slower:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,4 @@
+"""
+Crime and arrest counts by Chicago street segment, month and community, built in stages: fetch, features, snap, aggregate, rolling and export.
+"""
+from .pipeline import STAGES, run_pipeline
@@ -0,0 +1,648 @@
+"""
+Aggregate stage: the community by segment by month cube, its rollups and the aggregate store kept between runs.
+"""
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .config import AGGREGATE_STORE, INC_SCHEMA, PERIOD_COLUMNS
+from .frames import concat_frames, month_codes, month_labels, period_codes, period_labels
+from .metrics import measured
+from .snap import street_version
+
+
+# named aggregations by street segment
+SEG_AGG = dict(
+    # crime counts
+    gun_count=('is_gun', 'sum'),
+    gun_poss_count=('gun_possession', 'sum'),
+    robbery_count=('is_robbery', 'sum'),
+    violent_count=('is_violent', 'sum'),
+    homicide_count=('is_homicide', 'sum'),
+    agg_assault_count=('is_agg_assault', 'sum'),
+    theft_count=('is_theft', 'sum'),
+    viol_gun_count=('violent_gun', 'sum'),
+    total_crimes=('case_number', 'count'),  # total crimes on each street
+
+    # arrest counts by crime type
+    gun_arrests=('gun_arrests', 'sum'),
+    gun_poss_arrests=('gun_arrests', 'sum'),
+    robbery_arrests=('robbery_arrests', 'sum'),
+    violent_arrests=('violent_arrests', 'sum'),
+    homicide_arrests=('homicide_arrests', 'sum'),
+    agg_assault_arrests=('agg_assault_arrests', 'sum'),
+    theft_arrests=('theft_arrests', 'sum'),
+    total_arrests=('is_arrest', 'sum'),
+
+    # arrests by charge type, zero unless the arrests dataset is joined
+    felony_arrests=('felony_arrest', 'sum'),
+    misdemeanor_arrests=('misdemeanor_arrest', 'sum'),
+
+
+    # spatial-related stuff
+    ward=('ward', 'first'),
+    beat=('beat','first'),
+    district=('district', 'first'),
+    community=('community', 'first'),
+    logiclf=('logiclf', 'first'),
+    pre_dir=('pre_dir', 'first'),
+    street_nam=('street_nam', 'first'),
+    street_typ=('street_typ', 'first'),
+    case_number=('case_number', 'first')
+)
+
+# named aggregations by street segment and period
+SEG_TIME_AGG = dict(
+    violent_count=('is_violent', 'sum'),
+    gun_poss_count=('gun_possession', 'sum'),
+    total_crimes=('case_number', 'count'),
+    gun_poss_arrests=('gun_arrests', 'sum'),
+    violent_arrests=('violent_arrests', 'sum'),
+    total_arrests=('is_arrest', 'sum'),
+    ward=('ward', 'first'),
+    beat=('beat','first'),
+    district=('district', 'first'),
+    community=('community', 'first'),
+    logiclf=('logiclf', 'first'),
+    pre_dir=('pre_dir', 'first'),
+    street_nam=('street_nam', 'first'),
+    street_typ=('street_typ', 'first'),
+    case_number=('case_number', 'first')
+)
+
+
+# Neighborhood-Level Aggregates
+
+# named aggregations by streets within a community
+STREET_AGG = dict(
+    total_incidents=("case_number", "count"),
+    violent_incidents=("is_violent", "sum"),
+    gun_poss_count=("gun_possession", "sum"),
+    total_arrests=("is_arrest", "sum"),
+    violent_arrests=("violent_arrests", "sum"),
+    gun_poss_arrests=("gun_poss_arrests", "sum"),
+    comm_geom=('comm_geom', 'first')
+)
+
+# arrest rates, by the arrest count and the incident count it is taken over
+ARREST_RATES = dict(
+    gp_ar=('gun_poss_arrests', 'gun_poss_count'),
+    vi_ar=('violent_arrests', 'violent_count'),
+    total_ar=('total_arrests', 'total_crimes'),
+)
+
+# geographic levels seg_time is rolled up to, from the finest
+ROLLUP_LEVELS = ['segment', 'beat', 'district', 'ward', 'community']
+
+# Aggregation engine
+
+# incident columns totalled in the community by segment by month cube, every count and sum above is a rollup of these
+CUBE_MEASURES = list(dict.fromkeys(col for agg in (SEG_AGG, SEG_TIME_AGG, STREET_AGG)
+                                   for col, how in agg.values() if how in ('sum', 'count')))
+
+# street attributes joined onto the segment counts by trans_id
+STREET_ATTRS = ['logiclf', 'pre_dir', 'street_nam', 'street_typ']
+
+# incident attributes carried as the first non-null value per segment and per segment-period
+FIRST_COLS = list(dict.fromkeys(col for agg in (SEG_AGG, SEG_TIME_AGG)
+                                for col, how in agg.values() if how == 'first' and col not in STREET_ATTRS))
+
+
+def first_values(df, codes, n_groups, cols = FIRST_COLS):
+
+    """
+    Taking the first non-null value of each column per group code, as groupby first does; returns dataframe with one row per code.
+    df: dataframe the values are taken from
+    codes: integer group code of each row, -1 for rows left out
+    n_groups: number of group codes
+    cols: the columns to take values from
+    """
+
+    first_dict = {}
+    for col in cols:
+        values = df[col]
+        rows = np.flatnonzero(values.notna().values & (codes >= 0))
+        firsts = pd.Series(codes[rows]).drop_duplicates()
+        picked = values.iloc[rows[firsts.index.values]]
+        picked.index = firsts.values
+        first_dict[col] = picked.reindex(np.arange(n_groups))
+
+    return pd.DataFrame(first_dict)
+
+
+@measured('summarize_cube')
+def summarize_cube(isj_sub, period = 'month'):
+
+    """
+    Counting every measure once at the finest grain, community by segment by month and period; returns the cube and the first incident attributes by segment-month and by segment-period.
+    isj_sub: incidents joined to street segments and communities
+    period: day, week, month, quarter or year seg_time is counted by; the month is kept alongside for the aggregate store
+    """
+
+    # integer codes for every key, sorted so rollups come out in groupby order
+    comm_codes, communities = pd.factorize(isj_sub['community'], sort=True)
+    trans_codes, trans_ids = pd.factorize(isj_sub['trans_id'], sort=True)
+    months = month_codes(isj_sub['date'])
+    periods = months if period == 'month' else period_codes(isj_sub['date'], period)
+    n_trans = len(trans_ids)
+    n_periods = int(periods.max()) + 2 if len(periods) else 1
+
+    # month and period share one time code, a week running into the next month has a cell in each; incidents without a date
+    # have month and period -1
+    time_codes, times = pd.factorize(months.astype('int64') * n_periods + (periods + 1), sort=True)
+    n_times = len(times)
+
+    # one bincount per measure over the combined cell code
+    cell = (comm_codes.astype('int64') * n_trans + trans_codes) * n_times + time_codes
+    cell_codes, cells = pd.factorize(cell, sort=True)
+    times = times[cells % n_times]
+    cube = pd.DataFrame({
+        'community': communities.take(cells // (n_trans * n_times)),
+        'trans_id': trans_ids.take(cells // n_times % n_trans),
+        'month': (times // n_periods).astype('int32'),
+        'period': (times % n_periods - 1).astype('int32'),
+    })
+    for col in CUBE_MEASURES:
+        if col == 'case_number':
+            weights = isj_sub[col].notna().values
+        elif col not in isj_sub.columns:
+            # charge flags are only there when the arrests dataset is joined
+            weights = np.zeros(len(isj_sub))
+        else:
+            weights = isj_sub[col].values.astype('float64')
+        cube[col] = np.bincount(cell_codes, weights=weights, minlength=len(cells)).astype('int32')
+
+    # first values by segment and month, the aggregate store keeps them month by month and segment_firsts takes the ones
+    # by segment from them
+    n_months = int(months.max()) + 2 if len(months) else 1
+    seg_month_codes, seg_months = pd.factorize(trans_codes.astype('int64') * n_months + (months + 1), sort=True)
+    month_first = first_values(isj_sub, seg_month_codes, len(seg_months))
+    month_first.insert(0, 'trans_id', trans_ids.take(seg_months // n_months))
+    month_first.insert(1, 'month', (seg_months % n_months - 1).astype('int32'))
+
+    # incidents without a date only count towards segment totals
+    seg_period = np.where(periods >= 0, trans_codes.astype('int64') * n_periods + periods, -1)
+    seg_period_codes, seg_periods = pd.factorize(seg_period, sort=True)
+    seg_time_first = first_values(isj_sub, np.where(seg_period >= 0, seg_period_codes, -1), len(seg_periods))
+    seg_time_first.insert(0, 'trans_id', trans_ids.take(seg_periods // n_periods))
+    seg_time_first.insert(1, 'period', (seg_periods % n_periods).astype('int32'))
+    seg_time_first = seg_time_first[seg_periods >= 0].reset_index(drop=True)
+
+    return cube, month_first, seg_time_first
+
+
+def segment_firsts(month_first):
+
+    """
+    Taking the first incident attributes by segment from those by segment and month, earliest month first and incidents without a date last; returns dataframe with one row per trans_id.
+    month_first: first incident attributes by segment and month from summarize_cube or the aggregate store
+    """
+
+    order = np.where(month_first['month'] >= 0, month_first['month'], np.iinfo('int32').max)
+    month_first = month_first.iloc[np.argsort(order, kind='stable')]
+
+    return month_first.drop(columns='month').groupby('trans_id', sort=True).first().reset_index()
+
+
+def segment_attrs(isj_sub, street1 = None):
+
+    """
+    Collecting the street attributes of each segment; returns dataframe with one row per trans_id.
+    isj_sub: incidents joined to street segments, used when street1 is not given
+    street1: street segments with trans_id and street name columns
+    """
+
+    source = isj_sub if street1 is None else street1
+
+    return pd.DataFrame(source[['trans_id'] + STREET_ATTRS]).drop_duplicates('trans_id')
+
+
+def community_geoms(isj_sub, com1 = None):
+
+    """
+    Collecting the boundary of each community; returns dataframe with one row per community.
+    isj_sub: incidents joined to communities, used when com1 is not given
+    com1: community areas with community and comm_geom columns
+    """
+
+    source = isj_sub if com1 is None else com1
+
+    return pd.DataFrame(source[['community', 'comm_geom']]).drop_duplicates('community')
+
+
+def agg_layout(keys, counts, firsts, attrs, agg):
+
+    """
+    Laying out rolled-up counts, first values and joined attributes in the column order of a set of named aggregations; returns dataframe.
+    keys: dataframe of the group keys leading the output
+    counts: cube measures summed over each group, aligned with keys
+    firsts: first incident attributes by group, joined on the key columns they share with keys
+    attrs: attributes joined onto the groups, aligned with keys
+    agg: named aggregations giving the output columns, e.g. SEG_AGG
+    """
+
+    out = keys.reset_index(drop=True)
+    if firsts is not None:
+        firsts = out.merge(firsts, on=[col for col in out.columns if col in firsts.columns], how='left')
+    for name, (col, how) in agg.items():
+        if how in ('sum', 'count'):
+            out[name] = counts[col].values
+        elif col in attrs.columns:
+            out[name] = attrs[col].values
+        else:
+            out[name] = firsts[col].values
+
+    return out
+
+
+@measured('segment_counts')
+def segment_counts(cube, seg_first, street_attrs):
+
+    """
+    Deriving counts by street segment from the cube; returns the seg counts.
+    cube: counts by community and segment, with or without the month, from summarize_cube or the aggregate store
+    seg_first: first incident attributes by segment
+    street_attrs: street attributes by trans_id from segment_attrs
+    """
+
+    seg = cube.groupby('trans_id', sort=True)[CUBE_MEASURES].sum().reset_index()
+    attrs = seg[['trans_id']].merge(street_attrs, on='trans_id', how='left')
+
+    return agg_layout(seg[['trans_id']], seg, seg_first, attrs, SEG_AGG)
+
+
+@measured('segment_month_counts')
+def segment_month_counts(cube, seg_time_first, street_attrs, period = 'month', periods = None):
+
+    """
+    Deriving counts by street segment and period from the cube; returns the seg_time counts.
+    cube: counts by community, segment, month and period from summarize_cube
+    seg_time_first: first incident attributes by segment and period
+    street_attrs: street attributes by trans_id from segment_attrs
+    period: day, week, month, quarter or year the cube's periods are in
+    periods: optional period codes to keep, the others are left out as only some of their months were counted
+    """
+
+    # by period, labelled in the column PERIOD_COLUMNS gives it, and by year
+    keep = cube['period'] >= 0
+    if periods is not None:
+        keep &= cube['period'].isin(periods)
+    seg_time = cube[keep].groupby(['trans_id', 'period'], sort=True)[CUBE_MEASURES].sum().reset_index()
+    keys = seg_time[['trans_id', 'period']].copy()
+    labels, years = period_labels(seg_time['period'].values, period)
+    keys[PERIOD_COLUMNS[period]] = labels
+    keys['year'] = years
+    attrs = seg_time[['trans_id']].merge(street_attrs, on='trans_id', how='left')
+
+    # the period code stays for the rollups, the export leaves it out
+    return agg_layout(keys, seg_time, seg_time_first, attrs, SEG_TIME_AGG)
+
+
+def rollup_segments(cube, seg_first, seg_time_first, street_attrs, period = 'month'):
+
+    """
+    Deriving counts by street segment and by segment and period from the cube; returns the seg and seg_time counts.
+    cube: counts by community, segment, month and period from summarize_cube
+    seg_first: first incident attributes by segment
+    seg_time_first: first incident attributes by segment and period
+    street_attrs: street attributes by trans_id from segment_attrs
+    period: day, week, month, quarter or year the cube's periods are in
+    """
+
+    return segment_counts(cube, seg_first, street_attrs), segment_month_counts(cube, seg_time_first, street_attrs, period)
+
+
+def arrest_rates(counts, rates):
+
+    """
+    Adding arrest rates to counts, rounded to two decimals and 0 where nothing was counted; returns counts.
+    counts: dataframe with the arrest and incident counts of ARREST_RATES
+    rates: names of the rates to add, in the column order they are added in
+    """
+
+    for rate in rates:
+        arrests, incidents = ARREST_RATES[rate]
+        counts[rate] = (counts[arrests] / counts[incidents]).round(2)
+
+    # only the rates are filled, categorical and nullable integer columns keep their missing values
+    counts[list(rates)] = counts[list(rates)].fillna(0).astype('float32')
+
+    return counts
+
+
+@measured('summarize_rates')
+def summarize_rates(seg, seg_time):
+
+    """
+    Adding arrest rates to the seg and seg_time counts; returns seg and seg_time.
+    seg: counts by street segment from rollup_segments
+    seg_time: counts by street segment and period from rollup_segments
+    """
+
+    return arrest_rates(seg, ['gp_ar', 'vi_ar', 'total_ar']), arrest_rates(seg_time, ['total_ar', 'vi_ar', 'gp_ar'])
+
+
+@measured('rollup_levels')
+def rollup_levels(seg_time, com1, period = 'month'):
+
+    """
+    Rolling the seg_time counts up to every geographic level by period in one pass; returns dataframe of counts by level, integer key and period.
+    seg_time: counts by street segment and period from segment_month_counts, with the period codes
+    com1: community areas with community_area and community columns, giving each community its integer code
+    period: day, week, month, quarter or year the periods are in
+    """
+
+    # each segment-period is counted under the beat, district, ward and community seg_time gives it, as grouping seg_time would
+    area_codes = pd.Series(com1['community_area'].values, index=com1['community'].values)
+    keys = dict(
+        segment = pd.to_numeric(seg_time['trans_id']).astype('Int32'),
+        beat = seg_time['beat'].astype('Int32'),
+        district = seg_time['district'].astype('Int32'),
+        ward = seg_time['ward'].astype('Int32'),
+        community = seg_time['community'].astype('object').map(area_codes).astype('Int32'),
+    )
+    measures = [name for name, (col, how) in SEG_TIME_AGG.items() if how in ('sum', 'count')]
+
+    level_list = []
+    for level in ROLLUP_LEVELS:
+        counts = seg_time[measures].groupby([keys[level].rename('key'), seg_time['period']], sort=True, dropna=False).sum()
+        level_list.append(counts.reset_index().assign(level=level))
+    rollup = pd.concat(level_list, ignore_index=True)
+    rollup['level'] = pd.Categorical(rollup['level'], categories=ROLLUP_LEVELS)
+
+    labels, years = period_labels(rollup['period'].values, period)
+    rollup[PERIOD_COLUMNS[period]] = labels
+    rollup['year'] = years
+    rollup = rollup[['level', 'key', 'period'] + list(dict.fromkeys([PERIOD_COLUMNS[period], 'year'])) + measures]
+
+    return arrest_rates(rollup, ['total_ar', 'vi_ar', 'gp_ar'])
+
+
+@measured('rollup_streets')
+def rollup_streets(cube, comm_geoms):
+
+    """
+    Deriving counts by streets within a community from the cube; returns the street_summary counts.
+    cube: counts by community, segment and month from summarize_cube
+    comm_geoms: community boundaries from community_geoms
+    """
+
+    # by streets within a community
+    street_summary = cube.groupby(['community', 'trans_id'], sort=True, observed=True)[CUBE_MEASURES].sum().reset_index()
+    attrs = street_summary[['community']].merge(comm_geoms, on='community', how='left')
+
+    return agg_layout(street_summary[['community', 'trans_id']], street_summary, None, attrs, STREET_AGG)
+
+
+@measured('summarize_street_counts')
+def summarize_street_counts(street_summary):
+
+    """
+    Rolling street counts up to communities; returns the community summary and street_summary with arrest rates.
+    street_summary: counts by streets within a community from rollup_streets
+    """
+
+    # arrest rates
+    street_summary["total_ar"] = street_summary["total_arrests"] / street_summary["total_incidents"].replace(0, np.nan)
+    street_summary["vi_ar"] = street_summary["violent_arrests"] / street_summary["violent_incidents"].replace(0, np.nan)
+    street_summary["gp_ar"] = street_summary["gun_poss_arrests"] / street_summary["gun_poss_count"].replace(0, np.nan)
+    rates = ["total_ar", "vi_ar", "gp_ar"]
+    street_summary[rates] = street_summary[rates].fillna(0).astype('float32')
+
+    # community-level summary, each row of street_summary is a distinct street
+    comm = street_summary.groupby("community", observed=True).agg(
+        total_streets=("trans_id", "size"),
+        total_incidents=("total_incidents", "sum"),
+        violent_incidents=("violent_incidents", "sum"),
+        gun_poss_count=("gun_poss_count", "sum"),
+        total_arrests=("total_arrests", "sum"),
+        violent_arrests=("violent_arrests", "sum"),
+        gun_poss_arrests=("gun_poss_arrests", "sum"),
+        comm_geom=('comm_geom', 'first')
+
+    ).reset_index()
+
+    # % of streets with specific crime types or arrests, counted in one pass
+    pct_cols = {
+        "pct_streets_with_gun_possession": "gun_poss_count",
+        "pct_streets_with_gun_possession_arrest": "gun_poss_arrests",
+        "pct_streets_with_violent_incident": "violent_incidents",
+        "pct_streets_with_violent_arrest": "violent_arrests",
+    }
+    streets_with = (street_summary[list(pct_cols.values())] > 0).groupby(street_summary["community"], observed=True).sum()
+    for name, col in pct_cols.items():
+        comm[name] = (streets_with[col].reindex(comm["community"]).values / comm["total_streets"] * 100).round(2)
+    comm[list(pct_cols)] = comm[list(pct_cols)].fillna(0).astype('float32')
+
+
+    return comm, street_summary
+
+
+def summarize(isj_sub, street1 = None, period = 'month'):
+    cube, month_first, seg_time_first = summarize_cube(isj_sub, period)
+    seg, seg_time = rollup_segments(cube, segment_firsts(month_first), seg_time_first, segment_attrs(isj_sub, street1), period)
+
+    return summarize_rates(seg, seg_time)
+
+
+def summarize_neighborhoods(isj_sub, com1 = None):
+    cube = summarize_cube(isj_sub)[0]
+
+    return summarize_street_counts(rollup_streets(cube, community_geoms(isj_sub, com1)))
+
+# Streaming mode
+
+def combine_cubes(cube_list):
+
+    """
+    Merging cubes from several chunks of incidents; returns one cube.
+    cube_list: list of cubes from summarize_cube, in the order their chunks were read
+    """
+
+    cube = concat_frames(cube_list)
+
+    return cube.groupby(['community', 'trans_id', 'month', 'period'], sort=True, observed=True)[CUBE_MEASURES].sum().reset_index()
+
+
+def combine_firsts(df_list, keys):
+
+    """
+    Merging first incident attributes from several chunks; returns one dataframe keeping the earliest non-null values.
+    df_list: list of first-value dataframes from summarize_cube, in the order their chunks were read
+    keys: the columns the first values are grouped by
+    """
+
+    df = concat_frames(df_list)
+
+    return df.groupby(keys, sort=True).first().reset_index()
+
+
+def cube_parts(parts, compact_every = 8, period = 'month'):
+
+    """
+    Building and merging cubes part by part; returns the cube and the first incident attributes by segment-month and by segment-period.
+    parts: iterable of joined incidents, e.g. the snap stage checkpoints
+    compact_every: number of parts whose partial cubes are held before they are merged
+    period: day, week, month, quarter or year seg_time is counted by
+    """
+
+    cube_list, month_first_list, seg_time_first_list = [], [], []
+    for i, isj_sub in enumerate(parts):
+        cube, month_first, seg_time_first = summarize_cube(isj_sub, period)
+        cube_list.append(cube)
+        month_first_list.append(month_first)
+        seg_time_first_list.append(seg_time_first)
+        print(f"Chunk {i}: {len(isj_sub)} incidents summarized.")
+
+        # merge partial cubes now and then so memory follows the number of cells, not chunks
+        if len(cube_list) >= compact_every:
+            cube_list = [combine_cubes(cube_list)]
+            month_first_list = [combine_firsts(month_first_list, ['trans_id', 'month'])]
+            seg_time_first_list = [combine_firsts(seg_time_first_list, ['trans_id', 'period'])]
+
+    cube = combine_cubes(cube_list)
+
+    return cube, combine_firsts(month_first_list, ['trans_id', 'month']), combine_firsts(seg_time_first_list, ['trans_id', 'period'])
+
+
+# Aggregate store
+
+def cube_path(month, store_dir = AGGREGATE_STORE, part = 'cube'):
+
+    """
+    Locating the stored cube or first values of one month; returns the parquet path.
+    month: month code from month_codes, -1 for incidents without a date
+    store_dir: directory of the aggregate store
+    part: 'cube' for the counts, 'first' for the first incident attributes by segment
+    """
+
+    label = 'undated' if month < 0 else month_labels(np.array([month]))[0][0]
+
+    return Path(store_dir) / part / f'{label}.parquet'
+
+
+def aggregate_version(street1, max_distance = None, arrests = False, areas = None):
+
+    """
+    Identifying what the stored cube was built against; returns a version string.
+    street1: street segments the incidents were assigned to
+    max_distance: search radius the incidents were assigned with
+    arrests: whether the charge counts come from the arrests dataset
+    areas: optional list of area lookups from area_lookup the missing community and beat codes were filled from
+    """
+
+    # a change to the incident dtypes or the measures changes what is stored too, so it forces a full recompute
+    schema = hashlib.sha256(json.dumps([INC_SCHEMA, CUBE_MEASURES], sort_keys=True).encode()).hexdigest()[:8]
+
+    # new boundaries can move incidents the feed left without a community
+    if areas:
+        schema += '-' + hashlib.sha256(''.join(lookup['version'] for lookup in areas).encode()).hexdigest()[:8]
+
+    return f'{street_version(street1)}-{max_distance}-{schema}-{"arrests" if arrests else "incidents"}'
+
+
+def aggregates_current(version, store_dir = AGGREGATE_STORE):
+
+    """
+    Checking whether the aggregate store can be updated in place; returns True when it was built against version.
+    version: the aggregate_version of this run
+    store_dir: directory of the aggregate store
+    """
+
+    # stores written before the first values were kept by month are built again
+    path = Path(store_dir) / '_version.json'
+    if not path.exists() or not (Path(store_dir) / 'first').is_dir():
+        return False
+
+    with open(path) as f:
+        return json.load(f)['version'] == version
+
+
+def write_aggregates(totals, version, store_dir = AGGREGATE_STORE):
+
+    """
+    Writing the totals and version of the aggregate store, each through a temporary file.
+    totals: counts by community and segment over all months
+    version: the aggregate_version the cube was built against
+    store_dir: directory of the aggregate store
+    """
+
+    store_dir = Path(store_dir)
+    path = store_dir / 'totals.parquet'
+    totals.to_parquet(path.with_suffix('.tmp'), index=False)
+    os.replace(path.with_suffix('.tmp'), path)
+
+    path = store_dir / '_version.json'
+    with open(path.with_suffix('.tmp'), 'w') as f:
+        json.dump({'version': version}, f)
+    os.replace(path.with_suffix('.tmp'), path)
+
+
+@measured('save_aggregates')
+def save_aggregates(cube, month_first, version, store_dir = AGGREGATE_STORE):
+
+    """
+    Replacing the aggregate store with a full recompute; returns the totals by community and segment and the first values by segment.
+    cube: counts by community, segment and month over the full history
+    month_first: first incident attributes by segment and month
+    version: the aggregate_version the cube was built against
+    store_dir: directory of the aggregate store
+    """
+
+    for part, df in [('cube', cube), ('first', month_first)]:
+        shutil.rmtree(Path(store_dir) / part, ignore_errors=True)
+        (Path(store_dir) / part).mkdir(parents=True)
+        for month, rows in df.groupby('month'):
+            rows.to_parquet(cube_path(month, store_dir, part), index=False)
+    (Path(store_dir) / 'seg_first.parquet').unlink(missing_ok=True)
+
+    totals = cube.groupby(['community', 'trans_id'], sort=True, observed=True)[CUBE_MEASURES].sum().reset_index()
+    write_aggregates(totals, version, store_dir)
+
+    return totals, segment_firsts(month_first)
+
+
+@measured('update_aggregates')
+def update_aggregates(cube, month_first, months, version, store_dir = AGGREGATE_STORE):
+
+    """
+    Swapping re-aggregated months into the aggregate store; returns the updated totals by community and segment and first values by segment.
+    cube: counts by community, segment and month over the re-aggregated months
+    month_first: first incident attributes by segment and month over the re-aggregated months
+    months: the month codes that were re-aggregated
+    version: the aggregate_version the cube was built against
+    store_dir: directory of the aggregate store
+    """
+
+    # take out what the months used to contribute and add their fresh counts
+    stale = [pd.read_parquet(cube_path(m, store_dir)) for m in months if cube_path(m, store_dir).exists()]
+    for part in stale:
+        part[CUBE_MEASURES] = -part[CUBE_MEASURES]
+    totals = concat_frames([pd.read_parquet(Path(store_dir) / 'totals.parquet'), cube] + stale)
+    totals = totals.groupby(['community', 'trans_id'], sort=True, observed=True)[CUBE_MEASURES].sum().reset_index()
+
+    # streets whose incidents all moved away drop out, as they would from a full recompute
+    totals = totals[(totals[CUBE_MEASURES] != 0).any(axis=1)].reset_index(drop=True)
+
+    # the counts and first values of each month are swapped whole
+    for month in months:
+        for part, df in [('cube', cube), ('first', month_first)]:
+            rows = df[df['month'] == month]
+            path = cube_path(month, store_dir, part)
+            if len(rows):
+                rows.to_parquet(path.with_suffix('.tmp'), index=False)
+                os.replace(path.with_suffix('.tmp'), path)
+            elif path.exists():
+                path.unlink()
+    write_aggregates(totals, version, store_dir)
+
+    # first values by segment are taken again from every stored month, the same way a full recompute takes them, so a
+    # segment whose earliest incidents changed or moved away gets the values of the ones now earliest
+    stored = [pd.read_parquet(path) for path in sorted((Path(store_dir) / 'first').glob('*.parquet'))]
+
+    return totals, segment_firsts(concat_frames([month_first.iloc[:0]] + stored))
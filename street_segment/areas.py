@@ -0,0 +1,95 @@
+"""
+Placing incidents and street segments in community areas and police beats by point in polygon.
+"""
+import hashlib
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from .config import LAYER_CACHE, PROJECTED_CRS
+from .metrics import measured
+from .projection import project
+
+
+def locate_points(points, tree, codes, batch_size = 1000000):
+
+    """
+    Finding the area each point falls in through the boundary index, batch by batch; returns pandas array of area codes, missing for points outside every area.
+    points: array of shapely points in the crs of the index
+    tree: STRtree over the area boundaries
+    codes: area codes in the order of the tree
+    batch_size: number of points queried at once, bounding the memory of the match arrays
+    """
+
+    found = np.full(len(points), -1, dtype='int64')
+    for start in range(0, len(points), batch_size):
+        point_pos, area_pos = tree.query(points[start:start + batch_size], predicate='intersects')
+
+        # a point on a shared boundary takes the first area it touches
+        order = np.lexsort([area_pos, point_pos])
+        point_pos, area_pos = point_pos[order], area_pos[order]
+        first = np.r_[True, point_pos[1:] != point_pos[:-1]] if len(point_pos) else np.zeros(0, dtype=bool)
+        found[start + point_pos[first]] = area_pos[first]
+
+    return codes.take(found, allow_fill=True)
+
+
+def area_lookup(areas, code_col, street1, street_key, crs = PROJECTED_CRS, cache_dir = LAYER_CACHE):
+
+    """
+    Indexing a boundary layer and placing every street segment in it once per street network version; returns dictionary of the incident column, index, codes and segment areas.
+    areas: geopandas dataframe of boundaries with integer area codes, e.g. from community_layer or beat_layer
+    code_col: column of the area codes, named as the incident column it fills, e.g. community_area or beat
+    street1: street segments with trans_id and geometry, in crs
+    street_key: street_version of street1, naming the cached segment areas
+    crs: crs the incidents and segments are in, the boundaries are projected to it once
+    cache_dir: directory the segment areas are kept in, next to the other lookup tables of the street layer
+    """
+
+    # the tree prepares each boundary the first time a point is tested against it
+    geoms = np.asarray(project(areas.geometry, crs).values)
+    tree = shapely.STRtree(geoms)
+    codes = areas[code_col].array
+
+    digest = hashlib.sha256()
+    digest.update('\n'.join(codes.astype(str)).encode())
+    digest.update(b''.join(shapely.to_wkb(geoms)))
+    version = digest.hexdigest()[:16]
+
+    # segments are placed by their midpoint, which lies on the line itself
+    path = Path(cache_dir) / f'{code_col}_{street_key}_{version}.parquet'
+    if path.exists():
+        segments = pd.read_parquet(path)[code_col]
+    else:
+        midpoints = shapely.line_interpolate_point(np.asarray(street1.geometry.values), 0.5, normalized=True)
+        segments = pd.Series(locate_points(midpoints, tree, codes), index=pd.Index(street1['trans_id'].values, name='trans_id'), name=code_col)
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        segments.to_frame().to_parquet(path)
+
+    return dict(column = code_col, tree = tree, codes = codes, segments = segments, version = version)
+
+
+@measured('assign_areas')
+def assign_areas(isj_sub, lookups):
+
+    """
+    Filling the area codes the feed left missing, from the point of each incident and else from its street segment; returns isj_sub with the codes filled.
+    isj_sub: incidents assigned to street segments, with geometry, trans_id and the area code columns
+    lookups: list of area lookups from area_lookup
+    """
+
+    for lookup in lookups:
+        col = lookup['column']
+        missing = isj_sub[col].isna().values
+        if not missing.any():
+            continue
+
+        # incidents outside every boundary, e.g. on the lakefront, take the area of the segment they were assigned to
+        codes = pd.Series(locate_points(np.asarray(isj_sub.geometry.values[missing]), lookup['tree'], lookup['codes']), dtype=isj_sub[col].dtype)
+        codes = codes.fillna(isj_sub.loc[missing, 'trans_id'].map(lookup['segments']).reset_index(drop=True).astype(isj_sub[col].dtype))
+        isj_sub.loc[missing, col] = codes.values
+        print(f'{int(missing.sum())} incidents without a {col} placed, {int(codes.isna().sum())} left outside every area.')
+
+    return isj_sub
@@ -0,0 +1,49 @@
+"""
+Command line entry point of the pipeline, e.g. python -m street_segment --from export
+"""
+import argparse
+import os
+from pathlib import Path
+
+from .config import CHECKPOINT_DIR, PERIOD_COLUMNS, RUN_REPORT
+from .pipeline import STAGES, run_pipeline
+
+
+def parse_args(argv = None):
+
+    """
+    Reading the command line, with defaults taken from the environment the scheduled workflow sets; returns the parsed arguments.
+    argv: list of arguments, sys.argv when None
+    """
+
+    parser = argparse.ArgumentParser(prog='street_segment', description='Crime and arrest counts by Chicago street segment, month and community.')
+    parser.add_argument('--until', choices=STAGES, default='export', help='last stage to run')
+    parser.add_argument('--from', dest='start', choices=STAGES, help='first stage to run, earlier stages are taken from their checkpoints')
+    parser.add_argument('--force', action='store_true', help='run stages even when their inputs are unchanged')
+    parser.add_argument('--start-year', type=int, default=2014, help='first year of incidents')
+    parser.add_argument('--chunk-size', type=int, default=int(os.environ.get('INCIDENT_CHUNK_SIZE', 0)) or None,
+                        help='stream incidents in chunks of this many rows instead of loading the full history')
+    parser.add_argument('--max-distance', type=float, default=float(os.environ.get('SNAP_MAX_DISTANCE', 0)) or None,
+                        help='search radius in metres for the nearest street segment, unbounded when not set')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('SNAP_WORKERS', 0)) or os.cpu_count(),
+                        help='processes used for the nearest-segment assignment')
+    parser.add_argument('--incremental', action='store_true', default=os.environ.get('INCREMENTAL_AGGREGATES', '0') != '0',
+                        help='keep the cube between runs and only re-aggregate the months with new or updated incidents')
+    parser.add_argument('--arrests', action='store_true', default=os.environ.get('JOIN_ARRESTS', '0') != '0',
+                        help='download the arrests dataset and count arrests by charge type on each segment')
+    parser.add_argument('--period', choices=list(PERIOD_COLUMNS), default=os.environ.get('SEG_TIME_PERIOD', 'month'),
+                        help='time grain of the seg_time counts')
+    parser.add_argument('--checkpoint-dir', type=Path, default=CHECKPOINT_DIR, help='directory of the stage checkpoints')
+    parser.add_argument('--out-dir', type=Path, default=Path('.'), help='directory the output files are written to')
+    parser.add_argument('--report', default=os.environ.get('RUN_REPORT', RUN_REPORT),
+                        help='path of the json run report, kept out of the output directory the outputs are committed from; empty to skip it')
+    parser.add_argument('--profile', metavar='STEP', default=os.environ.get('PROFILE_STEP') or None,
+                        help='run one step or stage under cProfile, e.g. snap_to_segments, and write STEP.prof next to the report')
+
+    return parser.parse_args(argv)
+
+
+def main(argv = None):
+    args = vars(parse_args(argv))
+
+    run_pipeline(**args)
@@ -0,0 +1,88 @@
+"""
+Paths, portal settings and dtypes shared by the pipeline stages.
+"""
+from pathlib import Path
+
+# City of Chicago open data portal; point this at a local stand-in to run the readers offline
+SOCRATA_DOMAIN = 'https://data.cityofchicago.org'
+
+# local incident store, one parquet file per year plus the updated_on high-watermark
+INCIDENT_STORE = Path('data/incident_store')
+
+# crs of the feed's latitude and longitude and of the GeoParquet outputs, and the crs in metres the incidents are snapped in
+FEED_CRS = 'EPSG:4326'
+OUTPUT_CRS = 'EPSG:4326'
+PROJECTED_CRS = 'EPSG:26916'
+
+# longitude and latitude box around the city limits, with some margin; CPD's placeholder geocode in Missouri falls outside.
+# Only a rectangle, so Evanston, Oak Park, Cicero and the other suburbs inside it pass
+CITY_BOUNDS = [(-87.95, 41.63), (-87.50, 41.63), (-87.50, 42.03), (-87.95, 42.03)]
+
+# first date of the crimes feed, earlier dates are typos
+EARLIEST_DATE = '2001-01-01'
+
+# boundary and street layers cached as geoparquet, revalidated against the portal once the ttl runs out
+LAYER_CACHE = Path('data/layer_cache')
+LAYER_TTL = 30 * 24 * 60 * 60
+
+# time grains seg_time can be counted by, and the column and partition each one's periods are labelled in
+PERIOD_COLUMNS = {'day': 'day', 'week': 'week', 'month': 'year-month', 'quarter': 'year-quarter', 'year': 'year'}
+
+# low-cardinality string columns of the outputs, dictionary encoded so readers can filter on them cheaply
+DICTIONARY_COLS = ['logiclf', 'pre_dir', 'street_nam', 'street_typ', 'beat', 'district', 'community']
+
+# stage outputs of the pipeline runner, reused when a stage's inputs have not changed
+CHECKPOINT_DIR = Path('data/checkpoints')
+
+# community by segment by month cube kept between runs, one parquet file per month plus the totals over all months
+AGGREGATE_STORE = Path('data/aggregate_store')
+
+# cumulative sums by segment and month kept between runs, for the trailing window counts
+ROLLING_STORE = Path('data/rolling_store')
+
+# json run report and the profile written next to it, kept with the local stores rather than the committed outputs
+RUN_REPORT = Path('data/run_report.json')
+
+# dtypes the crimes feed is parsed with; timestamps are parsed as the pages come in, area codes are nullable integers
+INC_SCHEMA = {
+    'id': 'int64',
+    'case_number': 'str',
+    'date': 'datetime64[ns]',
+    'iucr': 'str',
+    'primary_type': 'category',
+    'description': 'category',
+    'arrest': 'bool',
+    'domestic': 'bool',
+    'beat': 'Int16',
+    'district': 'Int16',
+    'ward': 'Int16',
+    'community_area': 'Int8',
+    'year': 'int16',
+    'updated_on': 'datetime64[ns]',
+    'x_coordinate': 'float32',
+    'y_coordinate': 'float32',
+    'latitude': 'float64',
+    'longitude': 'float64',
+}
+
+# columns of the crimes feed the pipeline uses, pushed down to the portal as $select
+INC_COLUMNS = list(INC_SCHEMA)
+
+# dtypes the arrests feed is parsed with
+ARR_SCHEMA = {
+    'cb_no': 'int64',
+    'case_number': 'str',
+    'arrest_date': 'datetime64[ns]',
+    'race': 'category',
+    'charge_1_type': 'category',
+    'charge_1_class': 'category',
+}
+
+# columns of the arrests feed the charge flags are built from, pushed down to the portal as $select
+ARR_COLUMNS = ['case_number', 'charge_1_type']
+
+# incident flag set for each charge_1_type of the arrests made in a case
+CHARGE_TYPES = {'F': 'felony_arrest', 'M': 'misdemeanor_arrest'}
+
+# charge flags by case number from the last run that joined arrests, compared against to find the months they change
+ARREST_CHARGES = Path('data/arrest_charges.parquet')
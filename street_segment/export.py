@@ -0,0 +1,252 @@
+"""
+Export stage: joining the counts to street lines and writing the GeoParquet outputs.
+"""
+import shutil
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+from .aggregate import SEG_AGG, STREET_ATTRS
+from .config import CHARGE_TYPES, DICTIONARY_COLS, FEED_CRS, OUTPUT_CRS, PERIOD_COLUMNS
+from .frames import period_labels
+from .metrics import measured
+from .projection import project
+
+
+def attach_streets(counts, street, fill_cols = None):
+
+    """
+    Attaching street segment lines and attributes to counts by trans_id; returns geopandas dataframe in the crs of the street layer.
+    counts: seg or seg_time counts with a trans_id column
+    street: street network with trans_id, street name columns and geometry
+    fill_cols: count columns set to 0 for segments without incidents; when given every street segment is kept, otherwise every row of counts
+    """
+
+    streets = street[['trans_id'] + STREET_ATTRS + ['geometry']].reset_index()
+    counts = counts.drop(columns=[col for col in STREET_ATTRS if col in counts.columns])
+
+    if fill_cols is None:
+        joined = counts.merge(streets, on='trans_id', how='left')
+    else:
+        joined = streets.merge(counts, on='trans_id', how='left')
+        joined[fill_cols] = joined[fill_cols].fillna(0).astype(counts[fill_cols].dtypes.to_dict())
+
+    return gpd.GeoDataFrame(joined, geometry='geometry', crs=street.crs)
+
+
+@measured('write_geoparquet')
+def write_geoparquet(gdf, path, sort_cols = None, row_group_size = 10000):
+
+    """
+    Writing a geopandas dataframe as GeoParquet laid out for row group pruning; returns the number of row groups.
+    gdf: geopandas dataframe to write
+    path: parquet file to write
+    sort_cols: columns sorted on ahead of the spatial key, e.g. the month
+    row_group_size: most rows per row group
+    """
+
+    # Hilbert distance of each bounding box centre, so nearby geometries share row groups and their bbox stays tight
+    hilbert = pd.Series(np.iinfo('uint32').max, index=gdf.index, dtype='int64')
+    present = ~(gdf.geometry.isna() | gdf.geometry.is_empty)
+    if present.any():
+        hilbert[present] = gdf.geometry[present].hilbert_distance()
+    gdf = gdf.assign(_hilbert=hilbert.values).sort_values((sort_cols or []) + ['_hilbert'], kind='stable')
+    gdf = gdf.drop(columns='_hilbert').reset_index(drop=True)
+
+    # bbox covering columns and min/max statistics per row group, dictionaries only where the values repeat
+    gdf.to_parquet(path, index=False, write_covering_bbox=True, row_group_size=row_group_size,
+                   write_statistics=True, use_dictionary=[col for col in DICTIONARY_COLS if col in gdf.columns])
+
+    return -(-len(gdf) // row_group_size)
+
+
+def write_partitions(df, path, periods = None, period = 'month', write_part = write_geoparquet):
+
+    """
+    Writing counts as a parquet dataset partitioned by year and period, e.g. year-month; returns the number of partitions written.
+    df: dataframe of counts with the year and period label columns
+    path: directory of the dataset
+    periods: period codes whose partitions are replaced; the whole dataset is rewritten when None
+    period: day, week, month, quarter or year the counts are by, yearly counts are partitioned by year alone
+    write_part: function writing one partition's rows to a parquet path, e.g. write_geoparquet
+    """
+
+    path = Path(path)
+    keys = list(dict.fromkeys(['year', PERIOD_COLUMNS[period]]))
+    if periods is None:
+        if path.is_file():
+            path.unlink()
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        # clear the old partitions first, a period can end up with no rows at all
+        labels, years = period_labels(np.asarray(periods, dtype='int64'), period)
+        for label, year in zip(labels, years):
+            shutil.rmtree(path.joinpath(*[f'{key}={value}' for key, value in zip(keys, [year, label])]), ignore_errors=True)
+
+    # partition columns live in the directory names, not in the files
+    n_parts = 0
+    for values, part in df.groupby(keys, sort=True):
+        part_dir = path.joinpath(*[f'{key}={value}' for key, value in zip(keys, values)])
+        part_dir.mkdir(parents=True, exist_ok=True)
+        write_part(part.drop(columns=keys), part_dir / 'part-0.parquet')
+        n_parts += 1
+
+    return n_parts
+
+
+@measured('write_seg_time')
+def write_seg_time(seg_time_final, path = 'seg_time.parquet', periods = None, period = 'month'):
+
+    """
+    Writing seg_time as a GeoParquet dataset partitioned by year and period; returns the number of partitions written.
+    seg_time_final: geopandas dataframe of counts by street segment and period
+    path: directory of the dataset
+    periods: period codes whose partitions are replaced; the whole dataset is rewritten when None
+    period: day, week, month, quarter or year seg_time is counted by
+    """
+
+    return write_partitions(seg_time_final, path, periods, period, write_geoparquet)
+
+
+def write_rollup_part(rollup, path, row_group_size = 10000):
+
+    """
+    Writing one period of the rollup cube sorted by level and key, so a lookup only reads the row groups holding its key.
+    rollup: counts by level and integer key
+    path: parquet file to write
+    row_group_size: most rows per row group
+    """
+
+    rollup = rollup.sort_values(['level', 'key'], kind='stable')
+    rollup.to_parquet(path, index=False, row_group_size=row_group_size, write_statistics=True, use_dictionary=['level'])
+
+
+@measured('export_seg')
+def export_seg(seg, street, path = 'seg_summary.parquet', arrests = False):
+
+    """
+    Joining the seg counts to every street segment and writing them as GeoParquet; returns the exported geopandas dataframe.
+    seg: counts by street segment with arrest rates
+    street: street network with trans_id, street name columns and geometry, already in OUTPUT_CRS to skip reprojecting it
+    path: parquet file to write
+    arrests: whether to write the arrests by charge type, only counted when the arrests dataset is joined
+    """
+
+    seg_cols = [name for name, (col, how) in SEG_AGG.items() if how in ('sum', 'count')] + ['gp_ar', 'vi_ar', 'total_ar']
+    seg_final = attach_streets(seg, street, fill_cols = seg_cols)
+    seg_final = project(seg_final, OUTPUT_CRS)
+
+    sub = ['logiclf', 'pre_dir', 'street_nam', 'street_typ', 
+           'ward', 'beat', 'district', 'community', 'case_number','geometry', 'index', 'trans_id', 
+           'gun_count', 'gun_poss_count', 'robbery_count', 'violent_count', 'homicide_count', 'agg_assault_count',
+           'theft_count', 'viol_gun_count', 'total_crimes', 'gun_arrests', 'gun_poss_arrests', 'robbery_arrests', 
+           'violent_arrests', 'homicide_arrests', 'agg_assault_arrests', 'theft_arrests',
+           'total_arrests', 'gp_ar', 'vi_ar', 'total_ar']
+    if arrests:
+        sub += [name for name, (col, how) in SEG_AGG.items() if col in CHARGE_TYPES.values()]
+    seg_final = seg_final[sub]
+
+    write_geoparquet(seg_final, path)
+    print("'seg' dataframe joined to street data and exported as parquet file.")
+
+    return seg_final
+
+
+@measured('export_seg_time')
+def export_seg_time(seg_time, street, path = 'seg_time.parquet', periods = None, period = 'month'):
+
+    """
+    Joining the seg_time counts to their street segments and writing the year and period partitions; returns the exported geopandas dataframe.
+    seg_time: counts by street segment and period with arrest rates
+    street: street network with trans_id, street name columns and geometry, already in OUTPUT_CRS to skip reprojecting it
+    path: directory of the partitioned dataset
+    periods: period codes whose partitions are replaced; the whole dataset is rewritten when None
+    period: day, week, month, quarter or year seg_time is counted by
+    """
+
+    seg_time_final = attach_streets(seg_time, street)
+    seg_time_final = project(seg_time_final, OUTPUT_CRS)
+
+    # yearly counts have the year alone
+    time_cols = list(dict.fromkeys([PERIOD_COLUMNS[period], 'year']))
+    sub = ['ward', 'beat', 'district', 'community', 'logiclf', 'pre_dir', 'street_nam',
+           'street_typ', 'case_number', 'geometry', 'index', 'trans_id'] + time_cols + [
+           'violent_count', 'gun_poss_count', 'total_crimes', 'gun_poss_arrests', 'violent_arrests',
+           'total_arrests', 'total_ar', 'vi_ar', 'gp_ar'
+    ]
+    seg_time_final = seg_time_final[sub]
+
+    n_parts = write_seg_time(seg_time_final, path, periods, period)
+    print(f"'seg_time' dataframe joined to street data and exported as {n_parts} {PERIOD_COLUMNS[period]} partitions.")
+
+    return seg_time_final
+
+
+@measured('export_rollup')
+def export_rollup(rollup, path = 'rollup.parquet', periods = None, period = 'month'):
+
+    """
+    Writing the rollup cube as a parquet dataset partitioned by year and period; returns the number of partitions written.
+    rollup: counts by level, integer key and period from rollup_levels
+    path: directory of the partitioned dataset
+    periods: period codes whose partitions are replaced; the whole dataset is rewritten when None
+    period: day, week, month, quarter or year the counts are by
+    """
+
+    n_parts = write_partitions(rollup.drop(columns='period'), path, periods, period, write_rollup_part)
+    print(f"'rollup' dataframe exported as {n_parts} {PERIOD_COLUMNS[period]} partitions.")
+
+    return n_parts
+
+
+def write_rolling_part(seg_rolling, path, row_group_size = 10000):
+
+    """
+    Writing one month of the trailing window counts sorted by segment, so a lookup only reads the row groups holding its segment.
+    seg_rolling: trailing window counts by trans_id
+    path: parquet file to write
+    row_group_size: most rows per row group
+    """
+
+    seg_rolling = seg_rolling.sort_values('trans_id', kind='stable')
+    seg_rolling.to_parquet(path, index=False, row_group_size=row_group_size, write_statistics=True)
+
+
+@measured('export_rolling')
+def export_rolling(seg_rolling, path = 'seg_rolling.parquet', months = None):
+
+    """
+    Writing the trailing window counts as a parquet dataset partitioned by year and month; returns the number of partitions written.
+    seg_rolling: trailing window counts and arrest rates by trans_id and month from window_counts
+    path: directory of the partitioned dataset
+    months: month codes whose partitions are replaced; the whole dataset is rewritten when None
+    """
+
+    labels, years = period_labels(seg_rolling['month'].values, 'month')
+    seg_rolling = seg_rolling.drop(columns='month').assign(**{PERIOD_COLUMNS['month']: labels, 'year': years})
+    n_parts = write_partitions(seg_rolling, path, months, 'month', write_rolling_part)
+    print(f"'seg_rolling' dataframe exported as {n_parts} {PERIOD_COLUMNS['month']} partitions.")
+
+    return n_parts
+
+
+@measured('export_neighborhoods')
+def export_neighborhoods(neighborhood_summary, path = 'neighborhood_summary.parquet'):
+
+    """
+    Writing the community summary as GeoParquet; returns the exported geopandas dataframe.
+    neighborhood_summary: counts and street percentages by community with comm_geom
+    path: parquet file to write
+    """
+
+    # community boundaries are kept in the working crs, frames without one are taken to be in latitude and longitude
+    neighborhood_summary = gpd.GeoDataFrame(neighborhood_summary, geometry='comm_geom')
+    if neighborhood_summary.crs is None:
+        neighborhood_summary = neighborhood_summary.set_crs(FEED_CRS)
+    neighborhood_summary = project(neighborhood_summary, OUTPUT_CRS)
+    write_geoparquet(neighborhood_summary, path)
+    print("'neighborhood_summary' dataframe joined to street data and exported as parquet file.")
+
+    return neighborhood_summary
@@ -0,0 +1,123 @@
+"""
+Features stage: offense flags for each incident.
+"""
+import numpy as np
+import pandas as pd
+
+from .config import CHARGE_TYPES
+from .metrics import measured
+
+
+def offense_flags(df):
+
+    """
+    Applying the offense rules to each row; returns the dataframe with flag columns added.
+    df: dataframe with primary_type, description and domestic columns
+    """
+    
+    # assign enforcement drive offenses
+    enfor_do = ['GAMBLING', 'CONCEALED CARRY LICENSE VIOLATION', 'NARCOTICS', 'WEAPONS VIOLATION', 'OBSCENITY', 'PROSTITUTION', 'INTERFERENCE WITH PUBLIC OFFICER', 'LIQUOR LAW VIOLATION', 'OTHER NARCOTIC VIOLATION']
+    df['Enforcement Driven Incidents'] = np.where(df['primary_type'].isin(enfor_do), 1, 0)
+    
+    #assign domestic battery
+    df['Domestic Battery'] = np.where(df['description'].str.lower().str.contains('domestic|dom') == True, 1, 0)
+    
+    #Assign Domestic Violence
+    df['Domestic Violence'] = np.where(
+        (df['Domestic Battery'] == 1) |
+        ((df['primary_type'] == 'BATTERY') & (df['domestic'] == True)) |
+        ((df['primary_type'] == 'ASSAULT') & (df['domestic'] == True)) |
+        ((df['primary_type'] == 'CRIM SEXUAL ASSAULT') & (df['domestic'] == True)),
+        1, 0
+
+    )
+    # Remove simple marijuana possession (under 30g) and distribution/intent to sell (under 10g) from offense differences
+    df['simple-cannabis'] =  np.where((df['primary_type'] == 'NARCOTICS') &
+                                  (df['description'].isin(['POSS: CANNABIS 30GMS OR LESS', 'MANU/DEL:CANNABIS 10GM OR LESS'])), 1, 0)
+
+    df['primary_type'] = np.where(df['simple-cannabis'] == 1, 'NARCOTICS-CANNABIS', df['primary_type'])
+    
+    df['is_gun'] = np.where(df['description'].str.lower().str.contains('gun|firearm'), 1, 0)
+
+    # add gun possession variables
+    df['gun_possession'] = np.where((df['is_gun'] ==1) & (df['description'].\
+                                                        str.lower().str.contains("unlawful poss|possession|register|report") ==True), 1,0)
+
+    df['crim_sex_offense'] = np.where((df['primary_type'] == 'CRIM SEXUAL ASSAULT')| 
+                                (df['primary_type'].isin(['CRIMINAL SEXUAL ABUSE', 'AGG CRIMINAL SEXUAL ABUSE', 'AGG CRIMINAL SEXUAL ABUSE']) == True),
+                                      1, 0)
+    df['is_agg_assault'] =  np.where((df['primary_type'] == 'ASSAULT') & (df['description'].str.lower().str.contains('agg') == True), 1, 0)
+
+    df['is_violent'] = np.where((df['primary_type'] == 'ROBBERY')|
+                               (df['primary_type'] == 'HOMICIDE')|
+                               (df['crim_sex_offense'] == 1)|
+                                (df['is_agg_assault'] == 1), 1, 0)
+
+    df['is_burglary'] = np.where(df['primary_type'] == 'BURGLARY', 1, 0)
+
+    df['is_homicide'] = np.where(df['primary_type'] == 'HOMICIDE', 1, 0)
+
+    df['is_theft'] = np.where(df['primary_type'] == 'THEFT', 1, 0)
+    
+    df['is_domestic'] = np.where(df['domestic'] == True, 1, 0)
+    
+    df['is_robbery'] = np.where(df['primary_type'] == 'ROBBERY', 1, 0)
+    
+    df['violent_gun'] = np.where((df['is_violent'] == 1) & (df['is_gun'] == 1), 1, 0)
+    
+    return df
+
+
+@measured('offense_features')
+def offense_features(df):
+
+    """
+    Adding offense flags to incidents; returns the dataframe with int8 flag columns.
+    df: dataframe of incidents with primary_type, description and domestic columns
+    """
+
+    # the flags only depend on these columns, so each distinct combination is evaluated once
+    keys = ['primary_type', 'description', 'domestic']
+    codes = df.groupby(keys, dropna=False, observed=True, sort=False).ngroup().values
+    _, first = np.unique(codes, return_index=True)
+    combos = df[keys].iloc[first].reset_index(drop=True)
+    for col in ['primary_type', 'description']:
+        combos[col] = combos[col].astype(object)
+
+    flags = offense_flags(combos)
+    flag_cols = [col for col in flags.columns if col not in keys]
+
+    # gather the per-combination results back onto the incidents by code
+    df['primary_type'] = pd.Categorical(flags['primary_type']).take(codes)
+    for col in flag_cols:
+        df[col] = flags[col].values.astype('int8')[codes]
+
+    return df
+
+
+@measured('incident_features')
+def incident_features(inc, charges = None):
+
+    """
+    Building offense features; returns geopandas dataframe of the columns the later stages use.
+    inc: geopandas dataframe of incidents from incidents_to_gdf or iter_incident_chunks
+    charges: optional charge flags by case_number from arrest_charges, joined onto the incidents when given
+    """
+
+    inc = offense_features(inc)
+
+    inc["is_arrest"] = inc["arrest"].astype('int8')
+    sub = ['case_number', 'date','primary_type','arrest', 'domestic', 'beat',
+           'district', 'ward', 'community_area', 'year', 'geometry', 'Enforcement Driven Incidents',
+           'Domestic Battery', 'Domestic Violence', 'simple-cannabis', 'is_gun', 'gun_possession', 'is_arrest',
+           'crim_sex_offense', 'is_agg_assault', 'is_violent', 'is_burglary',
+           'is_homicide', 'is_theft', 'is_domestic', 'is_robbery', 'violent_gun']
+
+    if charges is not None:
+        flags = list(CHARGE_TYPES.values())
+        inc = inc.merge(charges, on='case_number', how='left')
+        inc[flags] = inc[flags].fillna(0).astype('int8')
+        sub = sub + flags
+    inc1 = inc[sub]
+
+    return inc1
@@ -0,0 +1,639 @@
+"""
+Fetch stage: pulling incidents, arrests, boundaries and streets from the City of Chicago data portal, and the local incident store.
+"""
+import datetime as dt
+import hashlib
+import io
+import json
+import os
+import ssl
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+from urllib.parse import urlencode, quote
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pcsv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .config import (ARR_COLUMNS, ARR_SCHEMA, ARREST_CHARGES, CHARGE_TYPES, FEED_CRS, INC_SCHEMA, INCIDENT_STORE, LAYER_CACHE,
+                     LAYER_TTL, PROJECTED_CRS, SOCRATA_DOMAIN)
+from .frames import arrow_to_frame, arrow_types, concat_frames, conform_schema, month_codes
+from .metrics import count_bytes, measured
+from .projection import project, project_xy
+from .validate import validate_incidents
+
+ssl._create_default_https_context = ssl._create_unverified_context
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+
+def socrata_url(dataset, params, base_url = SOCRATA_DOMAIN):
+
+    """
+    Building a SODA csv url for a dataset; returns the url as a string.
+    dataset: the four-by-four identifier of the dataset, e.g. ijzp-q8t2
+    params: dictionary of SoQL parameters, e.g. {'$limit': 200, '$where': "date > '2024-01-01'"}
+    base_url: the portal domain the dataset is served from
+    """
+
+    query = urlencode(params, quote_via=quote, safe="$,:()*")
+
+    return f'{base_url}/resource/{dataset}.csv?{query}'
+
+
+def socrata_session(concurrency = 8, retries = 5, backoff = 0.5):
+
+    """
+    Creating a keep-alive http session for the portal; returns a requests session.
+    concurrency: number of pooled connections, should match the number of fetch threads
+    retries: times a failed or throttled request is retried
+    backoff: base of the exponential wait between retries, in seconds
+    """
+
+    retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=[429, 500, 502, 503, 504],
+                  allowed_methods=['GET'])
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency, max_retries=retry)
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    # the portal is read without certificate checks, same as the ssl context above
+    session.verify = False
+
+    return session
+
+
+def month_windows(start_year = 2014, date_col = 'date'):
+
+    """
+    Splitting the years from start_year to today into monthly SoQL filters; returns a list of where clauses.
+    start_year: input starting year for requested data
+    date_col: the timestamp column the windows are taken over
+    """
+
+    today = dt.date.today()
+    months = pd.period_range(f'{start_year}-01', f'{today.year}-12', freq='M')
+    where_list = [f"{date_col} >= '{m.start_time:%Y-%m-%d}T00:00:00' and {date_col} < '{(m + 1).start_time:%Y-%m-%d}T00:00:00'"
+                  for m in months]
+
+    return where_list
+
+
+def fetch_page(session, url, schema = None, retries = 5, backoff = 0.5):
+
+    """
+    Downloading and parsing one page of csv; returns an arrow table.
+    session: the http session to download through
+    url: the SODA csv url of the page
+    schema: optional dictionary of column dtypes applied while parsing, e.g. INC_SCHEMA
+    retries: times a page that fails mid-download is requested again
+    backoff: base of the exponential wait between retries, in seconds
+    """
+
+    for attempt in range(retries + 1):
+        try:
+            response = session.get(url, timeout=300)
+            response.raise_for_status()
+            break
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+                requests.exceptions.ContentDecodingError):
+            # the adapter retries failed connections, this covers connections dropped while the body is read and bodies cut
+            # off part way through
+            if attempt == retries:
+                raise
+            time.sleep(backoff * 2 ** attempt)
+
+    count_bytes(len(response.content))
+    if len(response.content) == 0:
+        return pa.table({})
+
+    # parsed on arrow's threads straight from the response body; the portal writes floating timestamps
+    # as 2024-01-31T23:59:00.000, which the iso8601 parser reads, and empty fields are missing values
+    convert = pcsv.ConvertOptions(column_types=arrow_types(schema or {}), strings_can_be_null=True)
+
+    return pcsv.read_csv(pa.py_buffer(response.content), read_options=pcsv.ReadOptions(use_threads=True), convert_options=convert)
+
+
+def fetch_socrata(dataset, where_list, base_url = SOCRATA_DOMAIN, columns = None, schema = None, page_size = 50000, max_rows = None, concurrency = 8, session = None):
+
+    """
+    Fetching every page of several SoQL filters concurrently; returns arrow table with the pages in order.
+    dataset: the four-by-four identifier of the dataset, e.g. ijzp-q8t2
+    where_list: list of where clauses, e.g. from month_windows
+    base_url: the portal domain the dataset is served from
+    columns: optional list of columns to download, pushed down as $select
+    schema: optional dictionary of column dtypes applied while parsing, e.g. INC_SCHEMA
+    page_size: rows requested per page
+    max_rows: optional cap on the rows returned for each where clause
+    concurrency: number of pages downloaded at the same time
+    session: optional http session, one is created when not given
+    """
+
+    if session is None:
+        session = socrata_session(concurrency)
+    if max_rows is not None:
+        page_size = min(page_size, max_rows)
+
+    def page_url(where, offset):
+        params = {'$where': where, '$order': ':id', '$limit': page_size, '$offset': offset}
+        if columns is not None:
+            params['$select'] = ','.join(columns)
+        return socrata_url(dataset, params, base_url)
+
+    pages = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        # first page of every window up front, further pages only once the previous one comes back full
+        pending = {pool.submit(fetch_page, session, page_url(where, 0), schema): (i, 0) for i, where in enumerate(where_list)}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                i, n = pending.pop(future)
+                page = future.result()
+                pages[(i, n)] = page
+
+                offset = (n + 1) * page_size
+                if len(page) == page_size and (max_rows is None or offset < max_rows):
+                    pending[pool.submit(fetch_page, session, page_url(where_list[i], offset), schema)] = (i, n + 1)
+
+    # pages are chained without copying their columns; a column missing from a page or typed differently, e.g. all
+    # empty, is widened so the pages line up
+    tables = [pages[key] for key in sorted(pages) if pages[key].num_columns]
+
+    return pa.concat_tables(tables, promote_options='permissive') if tables else pa.table({})
+
+
+def cached_layer(url, crs = None, cache_dir = LAYER_CACHE, ttl = LAYER_TTL, session = None):
+
+    """
+    Reading a geojson layer through the local cache; returns geopandas dataframe of the layer.
+    url: the geojson url of the layer
+    crs: optional crs the layer is projected to before it is cached, e.g. "EPSG:26916"
+    cache_dir: directory the cached layers are kept in
+    ttl: seconds a cached layer is used without asking the portal whether it changed
+    session: optional http session, one is created when not given
+    """
+
+    # cache entries are named by a hash of the url and the crs they were projected to
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    key = hashlib.sha256(f'{url}|{crs}'.encode()).hexdigest()[:32]
+    data_path = cache_dir / f'{key}.parquet'
+    meta_path = cache_dir / f'{key}.json'
+
+    meta = None
+    if data_path.exists() and meta_path.exists():
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if time.time() - meta['fetched_at'] < ttl:
+            print(f"Layer read from cache: {url}")
+            return gpd.read_parquet(data_path)
+
+    # revalidate a stale entry, the portal answers 304 if the layer has not changed
+    headers = {}
+    if meta is not None:
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+    if session is None:
+        session = socrata_session(1)
+    response = session.get(url, headers=headers, timeout=600)
+
+    if response.status_code == 304:
+        print(f"Layer unchanged, read from cache: {url}")
+        gdf = gpd.read_parquet(data_path)
+    else:
+        response.raise_for_status()
+        count_bytes(len(response.content))
+        gdf = gpd.read_file(io.BytesIO(response.content))
+        if crs is not None:
+            gdf = project(gdf, crs)
+        gdf.to_parquet(data_path.with_suffix('.tmp'))
+        os.replace(data_path.with_suffix('.tmp'), data_path)
+
+    meta = {
+        'url': url,
+        'crs': crs,
+        'etag': response.headers.get('ETag', meta and meta.get('etag')),
+        'last_modified': response.headers.get('Last-Modified', meta and meta.get('last_modified')),
+        'fetched_at': time.time(),
+    }
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+
+    return gdf
+
+
+def read_watermark(store_dir = INCIDENT_STORE):
+
+    """
+    Reading the updated_on high-watermark of the incident store; returns the timestamp string or None.
+    store_dir: directory of the local incident store
+    """
+
+    path = Path(store_dir) / '_watermark.json'
+    if not path.exists():
+        return None
+
+    with open(path) as f:
+        return json.load(f)['updated_on']
+
+
+def write_watermark(df, store_dir = INCIDENT_STORE):
+
+    """
+    Advancing the high-watermark to the latest updated_on in df; returns the new watermark.
+    df: incidents that were just merged into the store
+    store_dir: directory of the local incident store
+    """
+
+    previous = read_watermark(store_dir)
+    if len(df) == 0:
+        return previous
+
+    latest = pd.to_datetime(df['updated_on']).max().strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3]
+    if previous is not None and previous > latest:
+        latest = previous
+
+    path = Path(store_dir) / '_watermark.json'
+    with open(path.with_suffix('.tmp'), 'w') as f:
+        json.dump({'updated_on': latest}, f)
+    os.replace(path.with_suffix('.tmp'), path)
+
+    return latest
+
+
+def read_dirty_months(store_dir = INCIDENT_STORE):
+
+    """
+    Reading the months with incidents added or changed since they were last aggregated; returns a sorted list of month codes.
+    store_dir: directory of the local incident store
+    """
+
+    path = Path(store_dir) / '_dirty_months.json'
+    if not path.exists():
+        return []
+
+    with open(path) as f:
+        return json.load(f)['months']
+
+
+def mark_dirty_months(months, store_dir = INCIDENT_STORE):
+
+    """
+    Adding months to the list waiting to be re-aggregated; returns the updated list of month codes.
+    months: month codes from month_codes, -1 for incidents without a date
+    store_dir: directory of the local incident store
+    """
+
+    dirty = sorted(set(read_dirty_months(store_dir)) | set(int(m) for m in months))
+
+    path = Path(store_dir) / '_dirty_months.json'
+    with open(path.with_suffix('.tmp'), 'w') as f:
+        json.dump({'months': dirty}, f)
+    os.replace(path.with_suffix('.tmp'), path)
+
+    return dirty
+
+
+def clear_dirty_months(months = None, store_dir = INCIDENT_STORE):
+
+    """
+    Taking months off the list waiting to be re-aggregated once they have been aggregated; returns the month codes still waiting.
+    months: month codes that were aggregated; every month when None
+    store_dir: directory of the local incident store
+    """
+
+    path = Path(store_dir) / '_dirty_months.json'
+    if not path.exists():
+        return []
+
+    # months marked by a fetch that ran after the aggregation stay on the list
+    dirty = [] if months is None else sorted(set(read_dirty_months(store_dir)) - set(months))
+    if not dirty:
+        path.unlink()
+        return []
+
+    with open(path.with_suffix('.tmp'), 'w') as f:
+        json.dump({'months': dirty}, f)
+    os.replace(path.with_suffix('.tmp'), path)
+
+    return dirty
+
+
+def merge_incidents(delta, store_dir = INCIDENT_STORE, start_year = 2014):
+
+    """
+    Upserting new and changed incidents into the year-partitioned store by id; returns the years rewritten.
+    delta: dataframe of incidents fetched since the last watermark
+    store_dir: directory of the local incident store
+    start_year: first year kept in the store, incidents whose date was corrected to before it are taken out
+    """
+
+    store_dir = Path(store_dir)
+    store_dir.mkdir(parents=True, exist_ok=True)
+    if len(delta) == 0:
+        return []
+
+    # pages read while the feed is being updated can list an incident twice, only its latest version is kept so the store
+    # stays unique by id
+    delta = delta.sort_values('updated_on', kind='stable').drop_duplicates('id', keep='last')
+
+    # an incident can move between years when its date is corrected, so check every partition for stale ids; one moved to
+    # before the start year only leaves its old partition
+    delta_ids = delta['id'].unique()
+    delta = delta[delta['year'].astype(int) >= start_year]
+    delta_years = delta['year'].astype(int)
+    touched = set(delta_years.unique())
+    for path in store_dir.glob('*.parquet'):
+        ids = pd.read_parquet(path, columns=['id'])['id']
+        if ids.isin(delta_ids).any():
+            touched.add(int(path.stem))
+
+    stale_list = []
+    for year in sorted(touched):
+        path = store_dir / f'{year}.parquet'
+        parts = []
+        if path.exists():
+            old = conform_schema(pd.read_parquet(path))
+            replaced = old['id'].isin(delta_ids)
+            stale_list.append(old.loc[replaced, 'date'])
+            parts.append(old[~replaced])
+        parts.append(delta[delta_years == year])
+        year_df = concat_frames(parts)
+
+        # kept in date order, so the first values taken by segment and period come from the earliest incidents however
+        # they were fetched
+        year_df = year_df.sort_values(['date', 'id'], kind='stable', ignore_index=True)
+
+        # write to a temporary file first so a failed run never leaves a half-written partition
+        year_df.to_parquet(path.with_suffix('.tmp'), index=False, row_group_size=100000)
+        os.replace(path.with_suffix('.tmp'), path)
+
+    # counts change both in the months incidents land in and the months their previous versions were in
+    mark_dirty_months(np.concatenate([month_codes(delta['date'])] + [month_codes(stale) for stale in stale_list]), store_dir)
+
+    return sorted(touched)
+
+
+def read_incident_store(store_dir = INCIDENT_STORE, start_year = 2014):
+
+    """
+    Reading the local incident store; returns pandas dataframe of incidents from start_year onward.
+    store_dir: directory of the local incident store
+    start_year: input starting year for requested data
+    """
+
+    paths = sorted(p for p in Path(store_dir).glob('*.parquet') if int(p.stem) >= start_year)
+    inc_df = concat_frames([conform_schema(pd.read_parquet(p)) for p in paths])
+
+    return inc_df
+
+
+def read_incident_months(months, store_dir = INCIDENT_STORE, start_year = 2014):
+
+    """
+    Reading the incidents of a few months from the local incident store; returns pandas dataframe of incidents in store order.
+    months: month codes from month_codes, -1 for incidents without a date
+    store_dir: directory of the local incident store
+    start_year: input starting year for requested data
+    """
+
+    months = np.asarray(months, dtype='int64')
+    undated = bool((months < 0).any())
+
+    # only the year partitions holding those months are opened, and the date filter is pushed down to the row groups
+    windows = ds.field('date').is_null() if undated else None
+    for code in months[months >= 0]:
+        start = pd.Timestamp(year=1970 + code // 12, month=code % 12 + 1, day=1)
+        window = (ds.field('date') >= start) & (ds.field('date') < start + pd.offsets.MonthBegin())
+        windows = window if windows is None else windows | window
+
+    years = set(1970 + months[months >= 0] // 12)
+    store_paths = sorted(p for p in Path(store_dir).glob('*.parquet') if int(p.stem) >= start_year)
+    paths = [p for p in store_paths if undated or int(p.stem) in years]
+    if windows is None or not paths:
+        # nothing to read, keep the columns of the store
+        paths, windows = store_paths[:1], ds.scalar(False)
+
+    return concat_frames([conform_schema(pd.read_parquet(p, filters=windows)) for p in paths])
+
+
+@measured('update_incident_store')
+def update_incident_store(start_year = 2014, store_dir = INCIDENT_STORE, base_url = SOCRATA_DOMAIN, columns = None, concurrency = 8):
+
+    """
+    Fetching incidents changed since the last run and merging them into the local store; returns dataframe of the fetched delta.
+    start_year: input starting year for requested data
+    store_dir: directory of the local incident store
+    base_url: the portal domain the dataset is served from
+    columns: optional list of columns to download and keep in the store
+    concurrency: number of pages downloaded at the same time
+    """
+
+    watermark = read_watermark(store_dir)
+
+    if watermark is None:
+        # empty store, seed it month by month
+        print("No incident store found, pulling full history")
+        where_list = month_windows(start_year, 'date')
+    else:
+        print(f"Pulling incidents updated after {watermark}")
+        # no date filter, an incident whose date was corrected to before the start year still has to leave the store
+        where_list = [f"updated_on > '{watermark}'"]
+
+    delta = fetch_socrata('ijzp-q8t2', where_list, base_url, columns, INC_SCHEMA, concurrency=concurrency)
+    delta = arrow_to_frame(delta, INC_SCHEMA)
+    print(f"{len(delta)} new or updated incidents")
+
+    merge_incidents(delta, store_dir, start_year)
+    write_watermark(delta, store_dir)
+
+    return delta
+
+
+@measured('incidents_to_gdf')
+def incidents_to_gdf(inc_df, convert_cook_crs = True, validate = True):
+
+    """
+    Building point geometries from the incident latitude and longitude; returns geopandas dataframe of incidents.
+    inc_df: pandas dataframe of incidents
+    convert_cook_crs: choose to convert to local espg to match beat data or not
+    validate: drop incidents breaking the validation rules before their points are built
+    """
+
+    if validate:
+        inc_df = validate_incidents(inc_df)[0]
+
+    # converting the espg to correct area for cook for beats and incidents to work together,
+    # the raw coordinates are projected in bulk so the points are only built once
+    crs = PROJECTED_CRS if convert_cook_crs == True else FEED_CRS
+    x, y = project_xy(inc_df.longitude, inc_df.latitude, FEED_CRS, crs)
+
+    # creating a geopandas dataframe from dataframe
+    inc_gdf = gpd.GeoDataFrame(
+    inc_df, geometry=gpd.points_from_xy(x, y, crs=crs)
+     )
+
+    return inc_gdf
+
+
+def iter_incident_chunks(store_dir = INCIDENT_STORE, start_year = 2014, chunk_size = 1000000, convert_cook_crs = True):
+
+    """
+    Reading the local incident store in fixed-size chunks; yields geopandas dataframes of incidents.
+    store_dir: directory of the local incident store
+    start_year: input starting year for requested data
+    chunk_size: most incidents held in memory at once
+    convert_cook_crs: choose to convert to local espg to match beat data or not
+    """
+
+    paths = sorted(p for p in Path(store_dir).glob('*.parquet') if int(p.stem) >= start_year)
+    for path in paths:
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield incidents_to_gdf(conform_schema(batch.to_pandas()), convert_cook_crs)
+
+
+@measured('arr_data_read')
+def arr_data_read(start_year = 2014, full_dataset = True, base_url = SOCRATA_DOMAIN, columns = None, concurrency = 8):
+    
+    """
+    Pulling in City of Chicago Arrest data; returns pandas dataframe of arrests.
+    start_year: input starting year for requested data
+    full_dataset: choose to pull in full dataset or small subset of data
+    base_url: the portal domain the dataset is served from
+    columns: optional list of columns to download; every column when None
+    concurrency: number of pages downloaded at the same time
+    """
+
+    
+
+    if full_dataset == True:
+        print("Pulling full dataset")
+        # pull in arrest data month by month, several months at a time
+        arr_df = fetch_socrata('dpt3-jri9', month_windows(start_year, 'arrest_date'), base_url, columns, ARR_SCHEMA, concurrency=concurrency)
+    else:
+        print("Small subset")
+        # first 200 arrests of each year between start year and current year
+        today = dt.date.today()
+        where_list = [f"arrest_date between '{year}-01-01T00:00:00' and '{year}-12-31T23:59:59'"
+                      for year in range(start_year, today.year + 1)]
+        arr_df = fetch_socrata('dpt3-jri9', where_list, base_url, columns, ARR_SCHEMA, max_rows=200, concurrency=concurrency)
+    arr_df = arrow_to_frame(arr_df, ARR_SCHEMA)
+
+    print(arr_df.shape)
+
+    return arr_df
+
+
+def arrest_charges(arr):
+
+    """
+    Flagging the types of charge brought in each case; returns pandas dataframe with one row per case_number.
+    arr: pandas dataframe of arrests from arr_data_read with case_number and charge_1_type
+    """
+
+    charges = pd.DataFrame({'case_number': arr['case_number'].astype('str')})
+    for charge_type, flag in CHARGE_TYPES.items():
+        charges[flag] = (arr['charge_1_type'] == charge_type).fillna(False).astype('int8').values
+
+    # a case with several arrestees is flagged once for each type of charge brought
+    charges = charges[arr['case_number'].notna().values]
+
+    return charges.groupby('case_number', sort=True).max().reset_index()
+
+
+def update_arrest_charges(start_year = 2014, path = ARREST_CHARGES, store_dir = INCIDENT_STORE, base_url = SOCRATA_DOMAIN, concurrency = 8):
+
+    """
+    Refreshing the charge flags of each case from the arrests dataset and marking the months of incidents whose flags changed; returns the charges dataframe.
+    start_year: input starting year for requested data
+    path: parquet file of the charge flags from the last run
+    store_dir: directory of the local incident store
+    base_url: the portal domain the dataset is served from
+    concurrency: number of pages downloaded at the same time
+    """
+
+    arr = arr_data_read(start_year, full_dataset = True, base_url = base_url, columns = ARR_COLUMNS, concurrency = concurrency)
+    charges = arrest_charges(arr)
+    flags = list(CHARGE_TYPES.values())
+
+    path = Path(path)
+    if path.exists():
+        # arrests made or charged after an incident was stored change its counts without touching its updated_on
+        both = charges.merge(pd.read_parquet(path), on='case_number', how='outer', suffixes=('', '_last'))
+        both = both.fillna(0)
+        changed = np.zeros(len(both), dtype=bool)
+        for flag in flags:
+            changed |= (both[flag] != both[f'{flag}_last']).values
+        cases = both.loc[changed, 'case_number'].tolist()
+
+        paths = [str(p) for p in sorted(Path(store_dir).glob('*.parquet')) if int(p.stem) >= start_year]
+        if cases and paths:
+            dates = ds.dataset(paths).to_table(columns=['date'], filter=ds.field('case_number').isin(cases)).to_pandas()['date']
+            months = np.unique(month_codes(dates))
+            mark_dirty_months(months, store_dir)
+            print(f'{len(cases)} cases with new or changed charges across {len(months)} months')
+
+    charges.to_parquet(path.with_suffix('.tmp'), index=False)
+    os.replace(path.with_suffix('.tmp'), path)
+
+    return charges
+
+
+@measured('street_network_read')
+def street_network_read(full_dataset = True, base_url = SOCRATA_DOMAIN, cache_dir = LAYER_CACHE, ttl = LAYER_TTL):
+    
+    """
+    Pulling in City of Chicago street network data; returns geopandas dataframe of transportation data.
+    full_dataset: choose to pull in full dataset or small subset of data
+    base_url: the portal domain the dataset is served from
+    cache_dir: directory the projected street layer is cached in
+    ttl: seconds the cached street layer is used before it is revalidated
+    """
+
+    if full_dataset == True:
+        print("Pulling full dataset")
+        limit = 20000000
+    else:
+        print("Small subset")
+        limit = 200
+
+    # pull in data, projected once and kept in the layer cache
+    street_gdf = cached_layer(f'{base_url}/resource/pr57-gg9e.geojson?$limit={limit}', PROJECTED_CRS, cache_dir, ttl)
+
+    print("Read in Chicago's Full Street Network as a geopandas dataframe.")
+
+    return street_gdf
+
+
+@measured('import_chi_boundaries')
+def import_chi_boundaries(boundary_name = "beat", base_url = SOCRATA_DOMAIN, cache_dir = LAYER_CACHE, ttl = LAYER_TTL):
+
+    """
+    importing chicago boundaries and returns a geopandas dataframe in the working crs
+    boundary_name: the name of the chicago boundary used in the import, beat or community_area
+    base_url: the portal domain the boundaries are served from
+    cache_dir: directory the projected boundary layers are cached in
+    ttl: seconds a cached boundary layer is used before it is revalidated
+    """
+    # projected once and kept in the layer cache, like the street network
+    if boundary_name == "beat":
+        #import police beats
+        df = cached_layer(f"{base_url}/api/views/n9it-hstw/rows.geojson", PROJECTED_CRS, cache_dir, ttl)
+    elif boundary_name == "community_area":
+        #import community areas
+        df = cached_layer(f"{base_url}/api/views/igwz-8jzy/rows.geojson?accessType=DOWNLOAD", PROJECTED_CRS, cache_dir, ttl)
+    else:
+        raise ValueError(f"Unknown boundary {boundary_name!r}, expected beat or community_area")
+
+    return df
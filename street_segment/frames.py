@@ -0,0 +1,211 @@
+"""
+Dataframe helpers shared by the pipeline stages.
+"""
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from .config import INC_SCHEMA
+
+
+def concat_frames(df_list):
+
+    """
+    Concatenating dataframes whose categorical columns have different categories; returns one dataframe.
+    df_list: list of dataframes with the same columns
+    """
+
+    # widen every categorical column to the union of categories so concat keeps it categorical
+    df_list = [df for df in df_list if len(df) > 0] or df_list[:1]
+    for col in df_list[0].select_dtypes(include='category').columns:
+        if all(isinstance(df[col].dtype, pd.CategoricalDtype) for df in df_list):
+            categories = pd.api.types.union_categoricals([df[col] for df in df_list]).categories
+            df_list = [df.assign(**{col: df[col].cat.set_categories(categories)}) for df in df_list]
+
+    return pd.concat(df_list, ignore_index=True)
+
+
+def conform_schema(df, schema = INC_SCHEMA):
+
+    """
+    Casting numeric and boolean columns written under an older schema to the current dtypes; returns df.
+    df: dataframe read back from a local store
+    schema: dictionary of column dtypes, e.g. INC_SCHEMA
+    """
+
+    for col, dtype in schema.items():
+        if col not in df.columns or dtype in ('str', 'category') or dtype.startswith('datetime') or df[col].dtype == dtype:
+            continue
+        # e.g. beat stored as a categorical of strings before it was an integer code
+        values = df[col]
+        if not pd.api.types.is_numeric_dtype(values):
+            values = pd.to_numeric(values.astype('object'))
+        df[col] = values.astype(dtype)
+
+    return df
+
+
+def arrow_types(schema):
+
+    """
+    Translating pandas dtypes to the arrow types the csv parser reads each column as; returns dictionary of arrow types by column.
+    schema: dictionary of column dtypes, e.g. INC_SCHEMA
+    """
+
+    types = {}
+    for col, dtype in schema.items():
+        if dtype == 'str':
+            types[col] = pa.string()
+        elif dtype == 'category':
+            # dictionary encoded while parsing, comes out of to_pandas as a categorical
+            types[col] = pa.dictionary(pa.int32(), pa.string())
+        elif isinstance(pd.api.types.pandas_dtype(dtype), pd.api.extensions.ExtensionDtype):
+            # nullable integers, e.g. ward, come out of to_pandas as floats whenever a value is missing anyway,
+            # and reading them as floats accepts codes written as 48.0 like pandas' parser did
+            types[col] = pa.float64()
+        else:
+            types[col] = pa.from_numpy_dtype(pd.api.types.pandas_dtype(dtype))
+
+    return types
+
+
+def arrow_to_frame(table, schema = INC_SCHEMA):
+
+    """
+    Converting an arrow table to pandas with the dtypes of the schema; returns pandas dataframe.
+    table: arrow table, e.g. from fetch_socrata
+    schema: dictionary of column dtypes, e.g. INC_SCHEMA
+    """
+
+    # nullable integer columns with missing values come out as floats and are cast back
+    return conform_schema(table.to_pandas(split_blocks=True), schema)
+
+
+def days_to_periods(days, period = 'month'):
+
+    """
+    Numbering the period each day falls in; returns int64 array of periods since the one holding 1 January 1970.
+    days: int64 array of days since 1 January 1970
+    period: day, week, month, quarter or year
+    """
+
+    if period == 'day':
+        return days
+    if period == 'week':
+        # weeks start on a monday, 1 January 1970 was a thursday
+        return (days + 3) // 7
+
+    months = days.astype('datetime64[D]').astype('datetime64[M]').astype('int64')
+
+    return months // {'month': 1, 'quarter': 3, 'year': 12}[period]
+
+
+def period_starts(codes, period = 'month'):
+
+    """
+    Finding the first day of each period; returns int64 array of days since 1 January 1970.
+    codes: array of period codes from period_codes
+    period: day, week, month, quarter or year
+    """
+
+    codes = np.asarray(codes, dtype='int64')
+    if period == 'day':
+        return codes
+    if period == 'week':
+        return codes * 7 - 3
+
+    months = codes * {'month': 1, 'quarter': 3, 'year': 12}[period]
+
+    return months.astype('datetime64[M]').astype('datetime64[D]').astype('int64')
+
+
+def period_codes(dates, period = 'month'):
+
+    """
+    Numbering the day, week, month, quarter or year of each timestamp; returns int32 array of periods since 1970, -1 where the date is missing.
+    dates: series of timestamps
+    period: day, week, month, quarter or year
+    """
+
+    # integer arithmetic on the day numbers, no timestamp fields or strings per row
+    days = dates.values.astype('datetime64[D]').astype('int64')
+
+    return np.where(dates.isna().values, -1, days_to_periods(days, period)).astype('int32')
+
+
+def period_labels(codes, period = 'month'):
+
+    """
+    Turning period codes back into labels; returns arrays of label strings and int16 years of each period's first day.
+    codes: array of period codes from period_codes
+    period: day, week, month, quarter or year; days and weeks are labelled 'YYYY-MM-DD' by their first day, months 'YYYY-MM', quarters 'YYYYQn' and years 'YYYY'
+    """
+
+    # format each distinct period once, then gather
+    uniq, inverse = np.unique(codes, return_inverse=True)
+    starts = period_starts(uniq, period).astype('datetime64[D]')
+    years = starts.astype('datetime64[Y]').astype('int64') + 1970
+    if period in ('day', 'week'):
+        labels = np.datetime_as_string(starts, unit='D')
+    elif period == 'month':
+        labels = np.datetime_as_string(starts, unit='M')
+    elif period == 'quarter':
+        labels = np.array([f'{year:04d}Q{code % 4 + 1}' for year, code in zip(years, uniq)])
+    else:
+        labels = years.astype(str)
+    inverse = inverse.reshape(-1)
+
+    return labels.astype(object)[inverse], years[inverse].astype('int16')
+
+
+def overlapping_periods(months, period = 'month'):
+
+    """
+    Finding the periods sharing at least a day with any of the months; returns sorted int64 array of period codes.
+    months: month codes from month_codes, codes below 0 are left out
+    period: day, week, month, quarter or year
+    """
+
+    months = np.asarray(months, dtype='int64')
+    months = months[months >= 0]
+    first = days_to_periods(period_starts(months, 'month'), period)
+    last = days_to_periods(period_starts(months + 1, 'month') - 1, period)
+
+    return np.unique(np.concatenate([np.arange(lo, hi + 1) for lo, hi in zip(first, last)] + [np.zeros(0, dtype='int64')]))
+
+
+def covering_months(months, period = 'month'):
+
+    """
+    Widening a set of months to every month of the periods they share a day with, so those periods can be counted whole; returns sorted int64 array of month codes.
+    months: month codes from month_codes, -1 for incidents without a date is kept
+    period: day, week, month, quarter or year
+    """
+
+    months = np.asarray(months, dtype='int64')
+    periods = overlapping_periods(months, period)
+    first = days_to_periods(period_starts(periods, period), 'month')
+    last = days_to_periods(period_starts(periods + 1, period) - 1, 'month')
+    covered = [np.arange(lo, hi + 1) for lo, hi in zip(first, last)]
+
+    return np.unique(np.concatenate(covered + [months[months < 0]]))
+
+
+def month_codes(dates):
+
+    """
+    Numbering the month of each timestamp; returns int32 array of months since January 1970, -1 where the date is missing.
+    dates: series of timestamps
+    """
+
+    return period_codes(dates, 'month')
+
+
+def month_labels(codes):
+
+    """
+    Turning month codes back into labels; returns arrays of 'YYYY-MM' strings and int16 years.
+    codes: array of months since January 1970
+    """
+
+    return period_labels(codes, 'month')
@@ -0,0 +1,229 @@
+"""
+Run metrics: wall and cpu time, peak memory, rows and bytes downloaded for each step, written out as a json run report.
+"""
+import cProfile
+import datetime as dt
+import functools
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+# metrics of the current run: one record per finished step, the steps running now with the highest memory seen in each,
+# and the profiler of the chosen step
+RUN_STATE = dict(steps = [], stack = [], peaks = [], bytes = 0, started = None, profile_step = None, profiler = None)
+
+# fetch threads add to the byte count concurrently
+BYTES_LOCK = threading.Lock()
+
+
+def start_run(profile_step = None):
+
+    """
+    Clearing the metrics of any earlier run in this process.
+    profile_step: optional step or stage name to run under cProfile, e.g. snap_to_segments
+    """
+
+    RUN_STATE.update(steps = [], stack = [], peaks = [], bytes = 0, started = dt.datetime.now().isoformat(timespec='seconds'),
+                     profile_step = profile_step, profiler = cProfile.Profile() if profile_step else None)
+
+
+def count_bytes(n):
+
+    """
+    Adding downloaded bytes to the run total, read by the steps measuring around the download.
+    n: number of bytes in the response body
+    """
+
+    with BYTES_LOCK:
+        RUN_STATE['bytes'] += n
+
+
+def n_rows(obj):
+
+    """
+    Counting the rows going in or out of a step; returns the count, or None when obj is not a dataframe.
+    obj: dataframe, or a tuple of dataframes whose first one is counted
+    """
+
+    if isinstance(obj, tuple) and obj:
+        obj = obj[0]
+
+    return len(obj) if hasattr(obj, 'columns') else None
+
+
+def peak_rss():
+
+    """
+    Reading the high-water mark of resident memory of this process so far; returns megabytes.
+    """
+
+    # kilobytes on linux, bytes on macos
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return rss / 2 ** 20 if sys.platform == 'darwin' else rss / 2 ** 10
+
+
+def step_rss():
+
+    """
+    Reading the high-water mark of resident memory since it was last reset, the whole run's when it cannot be reset; returns megabytes.
+    """
+
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 2 ** 10
+    except OSError:
+        pass
+
+    return peak_rss()
+
+
+def reset_step_rss():
+
+    """
+    Resetting the high-water mark of resident memory to what is resident now, on linux; elsewhere the mark keeps covering the whole run.
+    """
+
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def cpu_time():
+
+    """
+    Reading the cpu time of this process and its finished worker processes; returns seconds.
+    """
+
+    times = os.times()
+
+    return times.user + times.system + times.children_user + times.children_system
+
+
+@contextmanager
+def measure(name, rows_in = None):
+
+    """
+    Measuring a step of the run; yields the step record, callers can set rows_out and any other field on it.
+    name: step name, e.g. offense_features or a stage name
+    rows_in: optional number of rows going into the step
+    """
+
+    stack, peaks = RUN_STATE['stack'], RUN_STATE['peaks']
+    record = dict(step = name, stage = stack[0] if stack else name, rows_in = rows_in, rows_out = None)
+    profiler = RUN_STATE['profiler'] if name == RUN_STATE['profile_step'] else None
+
+    # the steps running now keep the peak they reached so far, then the mark starts again for this step
+    high = step_rss()
+    peaks[:] = [max(peak, high) for peak in peaks]
+    reset_step_rss()
+    stack.append(name)
+    peaks.append(step_rss())
+    wall, cpu, downloaded = time.perf_counter(), cpu_time(), RUN_STATE['bytes']
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield record
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        stack.pop()
+        peak = max(peaks.pop(), step_rss())
+        if peaks:
+            peaks[-1] = max(peaks[-1], peak)
+        record.update(
+            wall_s = round(time.perf_counter() - wall, 3),
+            cpu_s = round(cpu_time() - cpu, 3),
+            peak_rss_mb = round(peak, 1),
+            bytes_downloaded = RUN_STATE['bytes'] - downloaded,
+        )
+        RUN_STATE['steps'].append(record)
+
+
+def measured(name):
+
+    """
+    Measuring every call of a function as a step, counting the rows of its first argument and of its result; returns the decorator.
+    name: step name the calls are recorded under
+    """
+
+    def decorate(func):
+        @functools.wraps(func)
+        def run(*args, **kwargs):
+            with measure(name, n_rows(args[0]) if args else None) as record:
+                result = func(*args, **kwargs)
+                record['rows_out'] = n_rows(result)
+            return result
+        return run
+
+    return decorate
+
+
+def run_report(settings = None, status = 'completed'):
+
+    """
+    Collecting the metrics of the run; returns a dictionary with every step and totals by step name.
+    settings: optional run settings recorded with the report
+    status: how the run ended, completed or failed
+    """
+
+    # steps repeated for every chunk or file are added up, peak memory is the highest seen
+    totals = {}
+    for record in RUN_STATE['steps']:
+        total = totals.setdefault(record['step'], dict(calls = 0, wall_s = 0.0, cpu_s = 0.0, rows_in = 0, rows_out = 0,
+                                                       bytes_downloaded = 0, peak_rss_mb = 0.0))
+        total['calls'] += 1
+        for col in ['wall_s', 'cpu_s', 'rows_in', 'rows_out', 'bytes_downloaded']:
+            total[col] += record[col] or 0
+        total['peak_rss_mb'] = max(total['peak_rss_mb'], record['peak_rss_mb'])
+
+        # counts by name a step adds to its record, e.g. rows breaking each validation rule
+        for col, counts in record.items():
+            if isinstance(counts, dict):
+                for name, n in counts.items():
+                    total.setdefault(col, {}).setdefault(name, 0)
+                    total[col][name] += n
+    for total in totals.values():
+        total['wall_s'], total['cpu_s'] = round(total['wall_s'], 3), round(total['cpu_s'], 3)
+
+    return dict(
+        started = RUN_STATE['started'],
+        finished = dt.datetime.now().isoformat(timespec='seconds'),
+        status = status,
+        settings = settings or {},
+        peak_rss_mb = round(peak_rss(), 1),
+        bytes_downloaded = RUN_STATE['bytes'],
+        totals = totals,
+        steps = RUN_STATE['steps'],
+    )
+
+
+def write_report(path, settings = None, status = 'completed'):
+
+    """
+    Writing the run report as json, and the profile of the chosen step next to it as a pstats file.
+    path: json file to write
+    settings: optional run settings recorded with the report
+    status: how the run ended, completed or failed
+    """
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(run_report(settings, status), f, indent=2, default=str)
+    print(f'Run report written to {path}.')
+
+    if RUN_STATE['profiler'] is not None:
+        # readable with pstats, snakeviz or any other viewer of cProfile output
+        profile_path = path.with_name(f"{RUN_STATE['profile_step']}.prof")
+        RUN_STATE['profiler'].dump_stats(profile_path)
+        print(f'Profile of {RUN_STATE["profile_step"]} written to {profile_path}.')
@@ -0,0 +1,552 @@
+"""
+Staged pipeline runner: fetch, features, snap, aggregate, rolling and export, each checkpointed so a rerun picks up where its inputs changed.
+"""
+import hashlib
+import json
+import os
+import shutil
+from contextlib import nullcontext
+from pathlib import Path
+
+import geopandas as gpd
+import pandas as pd
+import pyarrow.parquet as pq
+import shapely
+
+from .aggregate import (ROLLUP_LEVELS, aggregate_version, aggregates_current, community_geoms, cube_parts, rollup_levels,
+                        rollup_streets, save_aggregates, segment_attrs, segment_counts, segment_firsts, segment_month_counts,
+                        summarize_rates, summarize_street_counts, update_aggregates)
+from .areas import area_lookup
+from .config import ARREST_CHARGES, CHECKPOINT_DIR, INC_COLUMNS, INC_SCHEMA, INCIDENT_STORE, OUTPUT_CRS, RUN_REPORT
+from .export import export_neighborhoods, export_rollup, export_rolling, export_seg, export_seg_time
+from .features import incident_features
+from .fetch import (clear_dirty_months, import_chi_boundaries, incidents_to_gdf, iter_incident_chunks, read_dirty_months,
+                    read_incident_months, read_incident_store, read_watermark, street_network_read, update_arrest_charges,
+                    update_incident_store)
+from .frames import covering_months, overlapping_periods
+from .metrics import measure, measured, start_run, write_report
+from .projection import project
+from .rolling import ROLLING_WINDOWS, cumulative_counts, month_counts, rolling_current, save_rolling, update_rolling, window_counts
+from .snap import join_segments, segment_index, snap_cache_path, snap_pool, street_version
+
+# stages in the order they run, each one reads the checkpoint of the stage before it
+STAGES = ['fetch', 'features', 'snap', 'aggregate', 'rolling', 'export']
+
+# settings a run falls back on, see the cli for what each one does
+DEFAULT_SETTINGS = dict(
+    start_year = 2014,
+    chunk_size = None,
+    max_distance = None,
+    workers = 1,
+    incremental = False,
+    arrests = False,
+    period = 'month',
+    checkpoint_dir = CHECKPOINT_DIR,
+    out_dir = Path('.'),
+    report = RUN_REPORT,
+    profile = None,
+)
+
+
+def fingerprint(*values):
+
+    """
+    Hashing the inputs of a stage; returns a short hex string.
+    values: anything json can write, paths and timestamps are written as strings
+    """
+
+    return hashlib.sha256(json.dumps(values, default=str, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def frame_version(df):
+
+    """
+    Hashing the contents of a dataframe, geometry columns included; returns a short hex string.
+    df: pandas or geopandas dataframe, e.g. the community boundaries
+    """
+
+    h = hashlib.sha256()
+    for col in df.columns:
+        if isinstance(df[col].dtype, gpd.array.GeometryDtype):
+            h.update(b''.join(shapely.to_wkb(df[col].values)))
+        else:
+            h.update(pd.util.hash_pandas_object(df[col], index=False).values.tobytes())
+
+    return h.hexdigest()[:16]
+
+
+def read_stage(stage, checkpoint_dir = CHECKPOINT_DIR):
+
+    """
+    Reading what a stage recorded when it last finished; returns the dictionary or None.
+    stage: one of STAGES
+    checkpoint_dir: directory of the stage checkpoints
+    """
+
+    path = Path(checkpoint_dir) / stage / '_stage.json'
+    if not path.exists():
+        return None
+
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_stage(stage, meta, checkpoint_dir = CHECKPOINT_DIR):
+
+    """
+    Recording that a stage finished, written last so a stage that fails part way is run again.
+    stage: one of STAGES
+    meta: dictionary with the stage fingerprint and anything later stages read back
+    checkpoint_dir: directory of the stage checkpoints
+    """
+
+    path = Path(checkpoint_dir) / stage / '_stage.json'
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path.with_suffix('.tmp'), 'w') as f:
+        json.dump(meta, f)
+    os.replace(path.with_suffix('.tmp'), path)
+
+
+def stage_current(stage, fp, checkpoint_dir = CHECKPOINT_DIR):
+
+    """
+    Checking whether a stage already ran on the same inputs; returns True when its checkpoint can be reused.
+    stage: one of STAGES
+    fp: fingerprint of the stage inputs for this run
+    checkpoint_dir: directory of the stage checkpoints
+    """
+
+    meta = read_stage(stage, checkpoint_dir)
+    if meta is None or meta['fingerprint'] != fp:
+        return False
+
+    print(f"Stage {stage}: inputs unchanged, reusing the checkpoint.")
+    return True
+
+
+def reset_stage(stage, checkpoint_dir = CHECKPOINT_DIR):
+
+    """
+    Emptying the checkpoint directory of a stage before it runs; returns the directory.
+    stage: one of STAGES
+    checkpoint_dir: directory of the stage checkpoints
+    """
+
+    path = Path(checkpoint_dir) / stage
+    shutil.rmtree(path, ignore_errors=True)
+    path.mkdir(parents=True)
+
+    return path
+
+
+@measured('write_checkpoint')
+def write_frame(df, path):
+
+    """
+    Writing a checkpoint frame as parquet, GeoParquet when it has a geometry column.
+    df: pandas or geopandas dataframe
+    path: parquet file to write
+    """
+
+    df.to_parquet(path, index=False)
+
+
+def read_frame(path):
+
+    """
+    Reading a checkpoint frame back; returns a geopandas dataframe when it was written with one.
+    path: parquet file written by write_frame
+    """
+
+    if b'geo' in (pq.read_schema(path).metadata or {}):
+        return gpd.read_parquet(path)
+
+    return pd.read_parquet(path)
+
+
+def iter_parts(stage, checkpoint_dir = CHECKPOINT_DIR):
+
+    """
+    Reading the parts a stage wrote one at a time; yields dataframes in the order they were written.
+    stage: one of STAGES
+    checkpoint_dir: directory of the stage checkpoints
+    """
+
+    for path in sorted((Path(checkpoint_dir) / stage).glob('part-*.parquet')):
+        yield read_frame(path)
+
+
+def community_layer(com):
+
+    """
+    Keeping the community columns the snap and aggregate stages use; returns geopandas dataframe of community areas.
+    com: community area boundaries from import_chi_boundaries
+    """
+
+    sub = ['geometry','area_num_1', 'community']
+    com1 = com[sub]
+    com1 = com1.rename(columns={'area_num_1':'community_area', 'geometry':'comm_geom'}).set_geometry('comm_geom')
+    com1['community_area'] = pd.to_numeric(com1['community_area']).astype('Int8')
+    com1['community'] = com1['community'].astype('category')
+
+    return com1
+
+
+def beat_layer(beat):
+
+    """
+    Keeping the beat number and boundary of each police beat; returns geopandas dataframe of beats.
+    beat: police beat boundaries from import_chi_boundaries
+    """
+
+    beat1 = beat[['geometry', 'beat_num']].rename(columns={'beat_num': 'beat'})
+    beat1['beat'] = pd.to_numeric(beat1['beat']).astype('Int16')
+
+    return beat1
+
+
+def street_layer(street):
+
+    """
+    Encoding the street name columns as categoricals; returns the street network and the segment columns the snap stage uses.
+    street: street network from street_network_read
+    """
+
+    street = street.astype({'pre_dir': 'category', 'street_nam': 'category', 'street_typ': 'category'})
+    sub = ['pre_dir','logiclf', 'street_nam','street_typ','trans_id', 'geometry']
+    street1 = street[sub]
+
+    return street, street1
+
+
+def load_layers(settings, layers):
+
+    """
+    Reading the community boundaries and street network the first time a stage needs them; returns the dictionary of layers.
+    settings: run settings, see DEFAULT_SETTINGS
+    layers: dictionary the layers are kept in for the rest of the run
+    """
+
+    if layers:
+        return layers
+
+    com1 = community_layer(import_chi_boundaries(boundary_name = "community_area"))
+    print('Community boundary data imported.')
+    beat1 = beat_layer(import_chi_boundaries(boundary_name = "beat"))
+    print('Beat boundary data imported.')
+    street, street1 = street_layer(street_network_read(full_dataset = True))
+    print('Street network data imported.')
+
+    # boundary indexes and segment areas are built once per run, the segment areas once per street network version
+    key = street_version(street1)
+    areas = [area_lookup(com1, 'community_area', street1, key), area_lookup(beat1, 'beat', street1, key)]
+
+    layers.update(com1 = com1, beat1 = beat1, street = street, street1 = street1, areas = areas,
+                  version = aggregate_version(street1, settings['max_distance'], settings['arrests'], areas))
+
+    return layers
+
+
+def incident_chunks(settings, months = None):
+
+    """
+    Reading incidents from the local store for the features stage; yields geopandas dataframes of incidents.
+    settings: run settings, see DEFAULT_SETTINGS
+    months: month codes to read when re-aggregating incrementally, the full history when None
+    """
+
+    if months is not None:
+        print(f'Re-aggregating {len(months)} months with new or updated incidents.')
+        yield incidents_to_gdf(read_incident_months(months, INCIDENT_STORE, settings['start_year']))
+    elif settings['chunk_size']:
+        print(f"Streaming in chunks of {settings['chunk_size']} incidents.")
+        yield from iter_incident_chunks(INCIDENT_STORE, settings['start_year'], settings['chunk_size'])
+    else:
+        yield incidents_to_gdf(read_incident_store(INCIDENT_STORE, settings['start_year']))
+        print('Incident data imported.')
+
+
+def run_fetch(settings, layers, upstream = None, force = False):
+
+    """
+    Fetch stage: updating the incident store, and the charge flags when arrests are joined, and deciding which incidents the run covers; returns the stage fingerprint.
+    settings: run settings, see DEFAULT_SETTINGS
+    layers: dictionary of layers shared by the stages
+    upstream: unused, the portal is the input of this stage
+    force: unused, the portal is always checked for new incidents
+    """
+
+    update_incident_store(settings['start_year'], columns = INC_COLUMNS)
+    print('Incident store updated.')
+
+    # the arrests dataset is only downloaded when its charges are joined onto the incidents
+    charges_version = None
+    if settings['arrests']:
+        charges = update_arrest_charges(settings['start_year'])
+        charges_version = frame_version(charges)
+        print('Arrest data imported.')
+
+    # only the dirty months are re-aggregated when the aggregate store and the partitioned outputs can be updated in place,
+    # along with the other months of any week, quarter or year they are part of, so those periods are counted whole
+    dirty = read_dirty_months()
+    months = None
+    if settings['incremental']:
+        version = load_layers(settings, layers)['version']
+        exported = read_stage('export', settings['checkpoint_dir']) or {}
+        out_dir = Path(settings['out_dir'])
+        if (aggregates_current(version) and rolling_current(version) and (out_dir / 'seg_time.parquet').is_dir()
+                and (out_dir / 'rollup.parquet').is_dir() and (out_dir / 'seg_rolling.parquet').is_dir()
+                and exported.get('period', 'month') == settings['period']):
+            months = covering_months(dirty, settings['period']).tolist()
+
+    fp = fingerprint('fetch', read_watermark(), months, settings['start_year'], settings['chunk_size'], INC_SCHEMA, charges_version)
+    write_stage('fetch', {'fingerprint': fp, 'months': months, 'dirty': dirty}, settings['checkpoint_dir'])
+
+    return fp
+
+
+def run_features(settings, layers, upstream, force = False):
+
+    """
+    Features stage: building offense features for the incidents the fetch stage picked; returns the stage fingerprint.
+    settings: run settings, see DEFAULT_SETTINGS
+    layers: dictionary of layers shared by the stages
+    upstream: fingerprint of the fetch stage
+    force: run even when the checkpoint is current
+    """
+
+    fp = fingerprint('features', upstream)
+    if not force and stage_current('features', fp, settings['checkpoint_dir']):
+        return fp
+
+    months = read_stage('fetch', settings['checkpoint_dir'])['months']
+    charges = pd.read_parquet(ARREST_CHARGES) if settings['arrests'] else None
+    out = reset_stage('features', settings['checkpoint_dir'])
+    n_parts = 0
+    for inc in incident_chunks(settings, months):
+        write_frame(incident_features(inc, charges = charges), out / f'part-{n_parts:05d}.parquet')
+        n_parts += 1
+    print(f'Offense features built for {n_parts} chunks.')
+
+    write_stage('features', {'fingerprint': fp, 'parts': n_parts}, settings['checkpoint_dir'])
+
+    return fp
+
+
+def run_snap(settings, layers, upstream, force = False):
+
+    """
+    Snap stage: assigning the featured incidents to street segments and communities; returns the stage fingerprint.
+    settings: run settings, see DEFAULT_SETTINGS
+    layers: dictionary of layers shared by the stages
+    upstream: fingerprint of the features stage
+    force: run even when the checkpoint is current
+    """
+
+    layers = load_layers(settings, layers)
+    fp = fingerprint('snap', upstream, street_version(layers['street1']), frame_version(layers['com1']),
+                     [lookup['version'] for lookup in layers['areas']], settings['max_distance'])
+    if not force and stage_current('snap', fp, settings['checkpoint_dir']):
+        return fp
+
+    street1 = layers['street1']
+    tree = segment_index(street1)
+    snap_cache = snap_cache_path(street1)
+
+    out = reset_stage('snap', settings['checkpoint_dir'])
+    n_parts = 0
+
+    # one pool for every chunk, its workers build their tree once
+    with snap_pool(tree, settings['workers']) or nullcontext() as pool:
+        for inc1 in iter_parts('features', settings['checkpoint_dir']):
+            isj_sub = join_segments(inc1, layers['com1'], street1, tree, settings['max_distance'], settings['workers'], snap_cache,
+                                    layers['areas'], pool)
+            write_frame(isj_sub, out / f'part-{n_parts:05d}.parquet')
+            n_parts += 1
+    print('Spatial join between street network and incident data completed.')
+
+    write_stage('snap', {'fingerprint': fp, 'parts': n_parts}, settings['checkpoint_dir'])
+
+    return fp
+
+
+def run_aggregate(settings, layers, upstream, force = False):
+
+    """
+    Aggregate stage: counting by segment, month and community, and updating the aggregate store; returns the stage fingerprint.
+    settings: run settings, see DEFAULT_SETTINGS
+    layers: dictionary of layers shared by the stages
+    upstream: fingerprint of the snap stage
+    force: run even when the checkpoint is current
+    """
+
+    layers = load_layers(settings, layers)
+    fp = fingerprint('aggregate', upstream, settings['incremental'], settings['period'])
+    if not force and stage_current('aggregate', fp, settings['checkpoint_dir']):
+        return fp
+
+    fetched = read_stage('fetch', settings['checkpoint_dir'])
+    months = fetched['months']
+    cube, month_first, seg_time_first = cube_parts(iter_parts('snap', settings['checkpoint_dir']), period = settings['period'])
+    if months is not None:
+        totals, seg_first = update_aggregates(cube, month_first, months, layers['version'])
+    elif settings['incremental']:
+        totals, seg_first = save_aggregates(cube, month_first, layers['version'])
+    else:
+        totals, seg_first = cube, segment_firsts(month_first)
+
+    # periods reaching past the re-aggregated months are left as they were exported
+    periods = None if months is None else overlapping_periods(fetched['dirty'], settings['period']).tolist()
+
+    street_attrs = segment_attrs(None, layers['street1'])
+    seg = segment_counts(totals, seg_first, street_attrs)
+    seg_time = segment_month_counts(cube, seg_time_first, street_attrs, settings['period'], periods)
+    seg, seg_time = summarize_rates(seg, seg_time)
+    rollup = rollup_levels(seg_time, layers['com1'], settings['period'])
+    neighborhood_summary, street_summary = summarize_street_counts(rollup_streets(totals, community_geoms(None, layers['com1'])))
+
+    print("Crime counts by street segment in 'seg' dataframe.")
+
+    print(f"Crime counts by street segment grouped at {settings['period']} level in 'seg_time' dataframe.")
+
+    print(f"Crime counts by {', '.join(ROLLUP_LEVELS)} and {settings['period']} in 'rollup' dataframe.")
+
+    print("Crime counts by each neighborhood in 'neighborhood_summary' dataframe.")
+
+    out = reset_stage('aggregate', settings['checkpoint_dir'])
+    write_frame(seg, out / 'seg.parquet')
+    write_frame(seg_time, out / 'seg_time.parquet')
+    write_frame(rollup, out / 'rollup.parquet')
+    write_frame(month_counts(cube), out / 'month_counts.parquet')
+    write_frame(gpd.GeoDataFrame(neighborhood_summary, geometry='comm_geom', crs=layers['com1']['comm_geom'].crs), out / 'neighborhood_summary.parquet')
+    write_frame(gpd.GeoDataFrame(street_summary, geometry='comm_geom', crs=layers['com1']['comm_geom'].crs), out / 'street_summary.parquet')
+
+    write_stage('aggregate', {'fingerprint': fp, 'months': months, 'periods': periods}, settings['checkpoint_dir'])
+
+    return fp
+
+
+def run_rolling(settings, layers, upstream, force = False):
+
+    """
+    Rolling stage: updating the cumulative sums by segment and month and taking the trailing window counts from them; returns the stage fingerprint.
+    settings: run settings, see DEFAULT_SETTINGS
+    layers: dictionary of layers shared by the stages
+    upstream: fingerprint of the aggregate stage
+    force: run even when the checkpoint is current
+    """
+
+    fp = fingerprint('rolling', upstream, settings['incremental'], ROLLING_WINDOWS)
+    if not force and stage_current('rolling', fp, settings['checkpoint_dir']):
+        return fp
+
+    layers = load_layers(settings, layers)
+    months = read_stage('aggregate', settings['checkpoint_dir'])['months']
+    counts = read_frame(Path(settings['checkpoint_dir']) / 'aggregate' / 'month_counts.parquet')
+    if months is not None:
+        store, months = update_rolling(counts, months, layers['version'])
+        months = months.tolist()
+    elif settings['incremental']:
+        store = save_rolling(counts, layers['version'])
+    else:
+        store = cumulative_counts(counts)
+
+    # only the months whose windows take in a re-aggregated month are taken again
+    seg_rolling = window_counts(store, months)
+    print(f"Trailing {', '.join(map(str, ROLLING_WINDOWS))} month counts by street segment in 'seg_rolling' dataframe.")
+
+    out = reset_stage('rolling', settings['checkpoint_dir'])
+    write_frame(seg_rolling, out / 'seg_rolling.parquet')
+
+    write_stage('rolling', {'fingerprint': fp, 'months': months}, settings['checkpoint_dir'])
+
+    return fp
+
+
+def run_export(settings, layers, upstream, force = False):
+
+    """
+    Export stage: joining the counts to street lines and writing the output files; returns the stage fingerprint.
+    settings: run settings, see DEFAULT_SETTINGS
+    layers: dictionary of layers shared by the stages
+    upstream: fingerprint of the rolling stage
+    force: run even when the checkpoint is current
+    """
+
+    out_dir = Path(settings['out_dir'])
+    outputs = [out_dir / 'seg_summary.parquet', out_dir / 'seg_time.parquet', out_dir / 'neighborhood_summary.parquet',
+               out_dir / 'rollup.parquet', out_dir / 'seg_rolling.parquet']
+    fp = fingerprint('export', upstream, settings['arrests'])
+    if not force and all(path.exists() for path in outputs) and stage_current('export', fp, settings['checkpoint_dir']):
+        return fp
+
+    layers = load_layers(settings, layers)
+    checkpoint = Path(settings['checkpoint_dir']) / 'aggregate'
+    periods = read_stage('aggregate', settings['checkpoint_dir'])['periods']
+
+    # street lines are projected once for both outputs, rather than once per row of seg_time
+    street = project(layers['street'], OUTPUT_CRS)
+    export_seg(read_frame(checkpoint / 'seg.parquet'), street, outputs[0], settings['arrests'])
+    export_seg_time(read_frame(checkpoint / 'seg_time.parquet'), street, outputs[1], periods, settings['period'])
+    export_neighborhoods(pd.DataFrame(read_frame(checkpoint / 'neighborhood_summary.parquet')), outputs[2])
+    export_rollup(read_frame(checkpoint / 'rollup.parquet'), outputs[3], periods, settings['period'])
+    export_rolling(read_frame(Path(settings['checkpoint_dir']) / 'rolling' / 'seg_rolling.parquet'), outputs[4],
+                   read_stage('rolling', settings['checkpoint_dir'])['months'])
+
+    # every month that was dirty when the incidents were fetched is aggregated now
+    clear_dirty_months(read_stage('fetch', settings['checkpoint_dir'])['dirty'])
+
+    write_stage('export', {'fingerprint': fp, 'period': settings['period']}, settings['checkpoint_dir'])
+
+    return fp
+
+
+# stage functions by name, in the order of STAGES
+STAGE_RUNNERS = dict(
+    fetch = run_fetch,
+    features = run_features,
+    snap = run_snap,
+    aggregate = run_aggregate,
+    rolling = run_rolling,
+    export = run_export,
+)
+
+
+def run_pipeline(until = 'export', start = None, force = False, **settings):
+
+    """
+    Running the stages in order up to until; returns the fingerprint of the last stage run.
+    until: last stage to run
+    start: first stage to run, the stages before it are taken from their checkpoints as they are
+    force: run every stage from start on even when its inputs are unchanged
+    settings: overrides of DEFAULT_SETTINGS, e.g. chunk_size or incremental
+    """
+
+    settings = {**DEFAULT_SETTINGS, **settings}
+    first = STAGES.index(start) if start is not None else 0
+
+    start_run(settings['profile'])
+    layers = {}
+    fp = None
+    try:
+        for i, stage in enumerate(STAGES[:STAGES.index(until) + 1]):
+            if i < first:
+                meta = read_stage(stage, settings['checkpoint_dir'])
+                if meta is None:
+                    raise ValueError(f"No checkpoint for the {stage} stage, run it before starting from {start}")
+                fp = meta['fingerprint']
+                continue
+
+            print(f"Stage {stage}")
+            with measure(stage):
+                fp = STAGE_RUNNERS[stage](settings, layers, fp, force)
+    except BaseException:
+        # a failed run still reports the stages it got through
+        if settings['report']:
+            write_report(settings['report'], settings, 'failed')
+        raise
+
+    if settings['report']:
+        write_report(settings['report'], settings)
+
+    return fp
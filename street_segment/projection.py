@@ -0,0 +1,79 @@
+"""
+Projecting coordinates and geometries between the feed, working and output crs with one cached transformer per pair.
+"""
+import functools
+
+import geopandas as gpd
+import numpy as np
+import pyproj
+import shapely
+
+
+@functools.lru_cache(maxsize=None)
+def transformer(from_crs, to_crs):
+
+    """
+    Building the transformer between two crs once per run; returns a pyproj Transformer taking x, y in that order.
+    from_crs: crs of the input, anything pyproj.CRS accepts
+    to_crs: crs of the output, anything pyproj.CRS accepts
+    """
+
+    return pyproj.Transformer.from_crs(from_crs, to_crs, always_xy=True)
+
+
+def same_crs(from_crs, to_crs):
+
+    """
+    Checking whether projecting between two crs would leave the coordinates as they are; returns True when it would.
+    from_crs: crs of the input
+    to_crs: crs of the output
+    """
+
+    return from_crs is not None and pyproj.CRS.from_user_input(from_crs) == pyproj.CRS.from_user_input(to_crs)
+
+
+def project_xy(x, y, from_crs, to_crs):
+
+    """
+    Projecting raw coordinate arrays in bulk, without building geometries; returns the projected x and y arrays.
+    x: array of x coordinates, or longitudes
+    y: array of y coordinates, or latitudes
+    from_crs: crs of the coordinates, e.g. "EPSG:4326"
+    to_crs: crs to project to, e.g. "EPSG:26916"
+    """
+
+    x, y = np.asarray(x, dtype='float64'), np.asarray(y, dtype='float64')
+    if same_crs(from_crs, to_crs):
+        return x, y
+
+    return transformer(pyproj.CRS.from_user_input(from_crs), pyproj.CRS.from_user_input(to_crs)).transform(x, y)
+
+
+def project(gdf, to_crs):
+
+    """
+    Projecting the active geometry of a geopandas dataframe or series, leaving it untouched when it is already in to_crs; returns the projected copy or gdf itself.
+    gdf: geopandas dataframe or series with a crs
+    to_crs: crs to project to, e.g. "EPSG:4326"
+    """
+
+    if same_crs(gdf.crs, to_crs):
+        return gdf
+
+    project_coords = transformer(pyproj.CRS.from_user_input(gdf.crs), pyproj.CRS.from_user_input(to_crs))
+
+    def transform(coords):
+        projected = coords.copy()
+        projected[:, 0], projected[:, 1] = project_coords.transform(coords[:, 0], coords[:, 1])
+        return projected
+
+    # every coordinate of every geometry goes through the transformer in one call, z values are kept as they are
+    geoms = gpd.GeoSeries(shapely.transform(np.asarray(gdf.geometry.values), transform, include_z=None),
+                          index=gdf.index, crs=to_crs, name=gdf.geometry.name)
+    if isinstance(gdf, gpd.GeoSeries):
+        return geoms
+
+    gdf = gdf.copy()
+    gdf[geoms.name] = geoms
+
+    return gdf
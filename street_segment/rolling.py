@@ -0,0 +1,280 @@
+"""
+Trailing 3, 12 and 36 month counts and arrest rates by street segment, from cumulative sums over a dense month by segment array.
+"""
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .aggregate import SEG_TIME_AGG, arrest_rates
+from .config import ROLLING_STORE
+from .metrics import measured
+
+# trailing windows in months, each one ending with the month it is reported for
+ROLLING_WINDOWS = [3, 12, 36]
+
+# seg_time counts kept as cumulative sums, every arrest rate is taken over two of them
+ROLLING_MEASURES = [name for name, (col, how) in SEG_TIME_AGG.items() if how in ('sum', 'count')]
+
+# arrest rates of each window, in the order of seg_time
+ROLLING_RATES = ['total_ar', 'vi_ar', 'gp_ar']
+
+
+def month_counts(cube, measures = ROLLING_MEASURES):
+
+    """
+    Totalling the cube by segment and month; returns dataframe of trans_id, month and the measures, incidents without a date left out.
+    cube: counts by community, segment, month and period from summarize_cube
+    measures: seg_time counts to total, each from the cube column SEG_TIME_AGG takes it from
+    """
+
+    dated = cube[cube['month'] >= 0]
+    sources = list(dict.fromkeys(SEG_TIME_AGG[name][0] for name in measures))
+    totals = dated.groupby(['trans_id', 'month'], sort=True, observed=True)[sources].sum()
+
+    counts = totals.index.to_frame(index=False)
+    for name in measures:
+        counts[name] = totals[SEG_TIME_AGG[name][0]].values
+
+    return counts
+
+
+def cumulative_counts(counts, measures = ROLLING_MEASURES):
+
+    """
+    Laying the counts out as a dense month by segment array and summing it along the months; returns dictionary of the segments, first month and cumulative sums.
+    counts: counts by trans_id and month from month_counts
+    measures: the count columns, in the order of the first axis of the sums
+    """
+
+    trans_codes, trans_ids = pd.factorize(counts['trans_id'], sort=True)
+    first, last = (int(counts['month'].min()), int(counts['month'].max())) if len(counts) else (0, -1)
+
+    # each month is one contiguous row of segments, after a leading row of zeros so the window ending at any month is one
+    # subtraction of two rows
+    cum = np.zeros((len(measures), last - first + 2, len(trans_ids)), dtype='int32')
+    cum[:, counts['month'].values - first + 1, trans_codes] = counts[measures].values.T
+    np.cumsum(cum, axis=1, dtype='int32', out=cum)
+
+    return trim_months(dict(trans_ids = pd.Index(trans_ids, name='trans_id'), first = first, cum = cum))
+
+
+def trim_months(store):
+
+    """
+    Dropping months without any count from either end of the cumulative sums, so they span the first to the last month with incidents; returns the store.
+    store: dictionary of the segments, first month and cumulative sums
+    """
+
+    # counts are never negative, so a month has incidents where the sums over every measure and segment go up
+    totals = store['cum'].sum(axis=(0, 2), dtype='int64')
+    counted = np.flatnonzero(np.diff(totals) > 0)
+    lo, hi = (counted[0], counted[-1]) if len(counted) else (0, -1)
+
+    return dict(trans_ids = store['trans_ids'], first = store['first'] + int(lo), cum = store['cum'][:, lo:hi + 2, :])
+
+
+def update_cumulative(store, counts, months, measures = ROLLING_MEASURES):
+
+    """
+    Swapping re-aggregated months into the cumulative sums, summing again from the earliest of them only; returns the updated store.
+    store: dictionary of the segments, first month and cumulative sums from cumulative_counts
+    counts: counts by trans_id and month over the re-aggregated months
+    months: the month codes that were re-aggregated, codes below 0 are left out
+    measures: the count columns, in the order of the first axis of the sums
+    """
+
+    # the sums only reach as far as the months with incidents, a week or quarter running into an empty month adds nothing
+    stored = store_months(store)
+    counted = np.union1d(stored, counts['month'].values)
+    months = np.asarray(months, dtype='int64')
+    months = months[(months >= counted[0]) & (months <= counted[-1])] if len(counted) else months[:0]
+    if not len(months):
+        return store
+
+    # segments seen for the first time get columns of zeros, months before or after the stored ones get rows
+    trans_ids = store['trans_ids'].append(pd.Index(counts['trans_id'].unique()).difference(store['trans_ids']))
+    first = int(counted[0])
+    n_months = int(counted[-1]) + 1 - first
+    n_stored = len(store['trans_ids'])
+    start = store['first'] - first
+    end = start + store['cum'].shape[1]
+    if (n_months + 1, len(trans_ids)) == store['cum'].shape[1:]:
+        cum = store['cum']
+    else:
+        cum = np.zeros((len(measures), n_months + 1, len(trans_ids)), dtype='int32')
+        cum[:, start:end, :n_stored] = store['cum']
+        cum[:, end:, :n_stored] = store['cum'][:, -1:, :]
+
+    # monthly counts from the earliest re-aggregated month on, with the re-aggregated months replaced; the rows before it
+    # are left as they are
+    k0 = int(months.min()) - first
+    monthly = np.diff(cum[:, k0:, :], axis=1)
+    monthly[:, months - first - k0, :] = 0
+    monthly[:, counts['month'].values - first - k0, trans_ids.get_indexer(counts['trans_id'])] = counts[measures].values.T
+    cum[:, k0 + 1:, :] = cum[:, k0:k0 + 1, :] + np.cumsum(monthly, axis=1, dtype='int32')
+
+    # months left without incidents at either end drop out, as they would from a full recompute
+    return trim_months(dict(trans_ids = pd.Index(trans_ids, name='trans_id'), first = first, cum = cum))
+
+
+def store_months(store):
+
+    """
+    Listing the months the cumulative sums cover; returns int64 array of month codes.
+    store: dictionary of the segments, first month and cumulative sums
+    """
+
+    return np.arange(store['first'], store['first'] + store['cum'].shape[1] - 1, dtype='int64')
+
+
+def window_months(months, covered, windows = ROLLING_WINDOWS):
+
+    """
+    Finding the months whose trailing windows take in any of the re-aggregated months; returns sorted int64 array of month codes.
+    months: the month codes that were re-aggregated
+    covered: month codes the sums cover, windows ending in any other month are never reported
+    windows: trailing windows in months
+    """
+
+    months = np.asarray(months, dtype='int64')
+    months = months[months >= 0]
+    reached = np.unique((months[:, None] + np.arange(max(windows))).ravel())
+
+    return np.intersect1d(reached, covered)
+
+
+@measured('window_counts')
+def window_counts(store, months = None, windows = ROLLING_WINDOWS, measures = ROLLING_MEASURES, block_size = 12):
+
+    """
+    Taking the trailing window counts and arrest rates of every segment by subtracting cumulative sums, a block of months at a time; returns dataframe of trans_id, month and the counts and rates of each window.
+    store: dictionary of the segments, first month and cumulative sums
+    months: month codes to report, every month of the store when None; months the store does not cover have nothing to report
+    windows: trailing windows in months
+    measures: the count columns, in the order of the first axis of the sums
+    block_size: number of months taken at once, bounding the memory of the window arrays
+    """
+
+    cum, first = store['cum'], store['first']
+    months = store_months(store) if months is None else np.intersect1d(np.asarray(months, dtype='int64'), store_months(store))
+
+    # an empty block still lays out the columns, when no month is asked for
+    frame_list = []
+    for start in range(0, max(len(months), 1), block_size):
+        block = months[start:start + block_size]
+        hi = block - first + 1
+        counts = {w: cum[:, hi, :] - cum[:, np.maximum(hi - w, 0), :] for w in windows}
+
+        # segments without an incident in the longest window have nothing to report in any of them
+        month_pos, seg_pos = np.nonzero(counts[max(windows)][measures.index('total_crimes')])
+
+        frame_dict = {'trans_id': store['trans_ids'].take(seg_pos), 'month': block[month_pos].astype('int32')}
+        for w in windows:
+            window = pd.DataFrame({col: counts[w][i][month_pos, seg_pos] for i, col in enumerate(measures)})
+            window = arrest_rates(window, ROLLING_RATES)
+            frame_dict.update({f'{col}_{w}m': window[col].values for col in window.columns})
+        frame_list.append(pd.DataFrame(frame_dict))
+
+    return pd.concat(frame_list, ignore_index=True)
+
+
+# Rolling store
+
+def rolling_current(version, measures = ROLLING_MEASURES, store_dir = ROLLING_STORE):
+
+    """
+    Checking whether the stored cumulative sums can be updated in place; returns True when they were built against version.
+    version: the aggregate_version of this run
+    measures: the count columns the sums are kept for
+    store_dir: directory of the rolling store
+    """
+
+    path = Path(store_dir) / '_version.json'
+    if not path.exists():
+        return False
+
+    with open(path) as f:
+        meta = json.load(f)
+
+    return meta['version'] == version and meta['measures'] == measures
+
+
+def read_rolling(store_dir = ROLLING_STORE):
+
+    """
+    Reading the stored cumulative sums back; returns dictionary of the segments, first month and cumulative sums.
+    store_dir: directory of the rolling store
+    """
+
+    store_dir = Path(store_dir)
+    with open(store_dir / '_version.json') as f:
+        first = json.load(f)['first']
+
+    return dict(trans_ids = pd.Index(pd.read_parquet(store_dir / 'segments.parquet')['trans_id'], name='trans_id'),
+                first = first, cum = np.load(store_dir / 'cumsums.npy'))
+
+
+def write_rolling(store, version, measures = ROLLING_MEASURES, store_dir = ROLLING_STORE):
+
+    """
+    Writing the cumulative sums, segments and version of the rolling store, each through a temporary file.
+    store: dictionary of the segments, first month and cumulative sums
+    version: the aggregate_version the counts were built against
+    measures: the count columns, in the order of the first axis of the sums
+    store_dir: directory of the rolling store
+    """
+
+    store_dir = Path(store_dir)
+    store_dir.mkdir(parents=True, exist_ok=True)
+
+    path = store_dir / 'cumsums.npy'
+    with open(path.with_suffix('.tmp'), 'wb') as f:
+        np.save(f, store['cum'])
+    os.replace(path.with_suffix('.tmp'), path)
+
+    path = store_dir / 'segments.parquet'
+    store['trans_ids'].to_frame(index=False).to_parquet(path.with_suffix('.tmp'), index=False)
+    os.replace(path.with_suffix('.tmp'), path)
+
+    path = store_dir / '_version.json'
+    with open(path.with_suffix('.tmp'), 'w') as f:
+        json.dump({'version': version, 'measures': measures, 'first': store['first']}, f)
+    os.replace(path.with_suffix('.tmp'), path)
+
+
+@measured('save_rolling')
+def save_rolling(counts, version, store_dir = ROLLING_STORE):
+
+    """
+    Replacing the rolling store with cumulative sums over the full history; returns the store.
+    counts: counts by trans_id and month over the full history
+    version: the aggregate_version the counts were built against
+    store_dir: directory of the rolling store
+    """
+
+    store = cumulative_counts(counts)
+    write_rolling(store, version, store_dir = store_dir)
+
+    return store
+
+
+@measured('update_rolling')
+def update_rolling(counts, months, version, store_dir = ROLLING_STORE):
+
+    """
+    Swapping re-aggregated months into the rolling store; returns the updated store and the months whose trailing windows changed.
+    counts: counts by trans_id and month over the re-aggregated months
+    months: the month codes that were re-aggregated
+    version: the aggregate_version the counts were built against
+    store_dir: directory of the rolling store
+    """
+
+    previous = read_rolling(store_dir)
+    store = update_cumulative(previous, counts, months)
+    write_rolling(store, version, store_dir = store_dir)
+
+    # windows ending in a month that dropped off either end of the sums are taken out too
+    return store, window_months(months, np.union1d(store_months(previous), store_months(store)))
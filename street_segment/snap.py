@@ -0,0 +1,319 @@
+"""
+Snap stage: assigning incidents to their nearest street segment and community.
+"""
+import hashlib
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from .areas import assign_areas
+from .config import LAYER_CACHE
+from .metrics import measured
+
+
+def street_version(street1):
+
+    """
+    Fingerprinting the street segments; returns a short hash that changes whenever a trans_id or centerline changes.
+    street1: street segments with trans_id and geometry
+    """
+
+    digest = hashlib.sha256()
+    digest.update('\n'.join(street1['trans_id'].astype(str)).encode())
+    digest.update(b''.join(shapely.to_wkb(street1.geometry.values)))
+
+    return digest.hexdigest()[:16]
+
+
+@measured('segment_index')
+def segment_index(street1, cache_dir = LAYER_CACHE):
+
+    """
+    Building the spatial index over the street centerlines; returns a shapely STRtree in the row order of street1.
+    street1: street segments with trans_id and geometry
+    cache_dir: directory of the cached street layer, cleared of the packed segment arrays earlier versions kept there
+    """
+
+    # the street layer comes out of the cache with its geometries decoded, so the tree is built straight from them
+    for stale in Path(cache_dir).glob('segments_*.npz'):
+        stale.unlink()
+
+    return shapely.STRtree(np.asarray(street1.geometry.values))
+
+
+# segment index of a snapping worker, built once in each worker process
+WORKER_STATE = {}
+
+# batches with fewer points are snapped serially, a pool would take longer to start than the query
+PARALLEL_MIN_POINTS = 100000
+
+
+def init_snap_worker(geom_type, coords, offsets):
+
+    """
+    Building the segment index of a new worker process from packed segment arrays.
+    geom_type: geometry type of the segments, from shapely.to_ragged_array
+    coords: coordinate array from shapely.to_ragged_array
+    offsets: tuple of offset arrays from shapely.to_ragged_array
+    """
+
+    # built over the segments in the same order as the parent's tree, so segment positions agree
+    WORKER_STATE['tree'] = shapely.STRtree(shapely.from_ragged_array(geom_type, coords, offsets))
+
+
+def nearest_segments_task(x, y, max_distance = None):
+
+    """
+    Snapping one partition of points in a worker process; returns point positions, segment positions and distances.
+    x: array of projected x coordinates
+    y: array of projected y coordinates
+    max_distance: optional search radius for the nearest segment
+    """
+
+    (left, right), distances = WORKER_STATE['tree'].query_nearest(shapely.points(x, y), max_distance=max_distance, return_distance=True)
+
+    return left, right, distances
+
+
+def snap_pool(tree, workers):
+
+    """
+    Starting the process pool points are snapped across, to be reused for every batch of a stage; returns a ProcessPoolExecutor, or None when snapping stays serial.
+    tree: the STRtree from segment_index
+    workers: number of processes; more than one needs the forkserver start method
+    """
+
+    if workers <= 1 or 'forkserver' not in multiprocessing.get_all_start_methods():
+        return None
+
+    # workers come from a forkserver rather than a fork of this process, whose download and export threads could hold locks
+    # a forked child never gets back; each one builds the tree once from the packed segments, after that only coordinate
+    # arrays and results cross process boundaries
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload([__name__])
+
+    return ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_snap_worker,
+                               initargs=shapely.to_ragged_array(tree.geometries))
+
+
+def parallel_nearest_segments(points, pool, workers, max_distance = None, tile_size = 1000):
+
+    """
+    Snapping points to their nearest segment across a pool of processes; returns point positions, segment positions and distances in serial order.
+    points: array of shapely points
+    pool: the process pool from snap_pool
+    workers: number of processes in the pool
+    max_distance: optional search radius for the nearest segment
+    tile_size: side in metres of the grid tiles points are partitioned by
+    """
+
+    valid = np.flatnonzero(~(shapely.is_missing(points) | shapely.is_empty(points)))
+    x = shapely.get_x(points[valid])
+    y = shapely.get_y(points[valid])
+
+    # order points by grid tile so each partition queries a compact part of the tree
+    tiles = np.lexsort((np.floor(x / tile_size), np.floor(y / tile_size)))
+    partitions = [part for part in np.array_split(tiles, workers * 4) if len(part) > 0]
+
+    futures = [pool.submit(nearest_segments_task, x[part], y[part], max_distance) for part in partitions]
+    results = [future.result() for future in futures]
+
+    left = np.concatenate([valid[part][l] for part, (l, r, d) in zip(partitions, results)] or [np.array([], dtype=np.intp)])
+    right = np.concatenate([r for l, r, d in results] or [np.array([], dtype=np.intp)])
+    distances = np.concatenate([d for l, r, d in results] or [np.array([], dtype=float)])
+
+    # back to the order of the serial query; a stable sort keeps equidistant segments in tree order
+    order = np.argsort(left, kind='stable')
+
+    return left[order], right[order], distances[order]
+
+
+def nearest_segments(points, tree, max_distance = None, workers = 1, pool = None):
+
+    """
+    Finding the nearest street segment of each point; returns point positions, segment positions and distances.
+    points: array of shapely points
+    tree: the STRtree from segment_index
+    max_distance: optional search radius for the nearest segment
+    workers: number of processes to snap with; more than one needs the forkserver start method
+    pool: optional process pool from snap_pool, one is started for this batch alone when not given
+    """
+
+    if workers > 1 and len(points) >= PARALLEL_MIN_POINTS:
+        if pool is not None:
+            return parallel_nearest_segments(points, pool, workers, max_distance)
+        pool = snap_pool(tree, workers)
+        if pool is not None:
+            with pool:
+                return parallel_nearest_segments(points, pool, workers, max_distance)
+
+    # one vectorized nearest query for the whole batch; ties keep every equidistant segment, like sjoin_nearest
+    (left, right), distances = tree.query_nearest(points, max_distance=max_distance, return_distance=True)
+
+    return left, right, distances
+
+
+def snap_cache_path(street1, cache_dir = LAYER_CACHE):
+
+    """
+    Locating the coordinate to segment lookup table for this version of the street layer; returns the parquet path.
+    street1: street segments with trans_id and geometry
+    cache_dir: directory the lookup tables are kept in
+    """
+
+    return Path(cache_dir) / f'snaps_{street_version(street1)}.parquet'
+
+
+def cached_nearest_segments(points, tree, snap_cache, street1, max_distance = None, workers = 1, decimals = 2, pool = None):
+
+    """
+    Finding the nearest street segment of each point through the coordinate lookup table; returns point positions, segment positions and distances.
+    points: array of shapely points
+    tree: the STRtree from segment_index
+    snap_cache: parquet path of the lookup table, from snap_cache_path
+    street1: street segments the tree was built over, used to record trans_id in the table
+    max_distance: optional search radius for the nearest segment
+    workers: number of processes never-seen coordinates are snapped with
+    decimals: decimals the projected coordinates are rounded to before lookup
+    pool: optional process pool from snap_pool
+    """
+
+    snap_cache = Path(snap_cache)
+    valid = np.flatnonzero(~(shapely.is_missing(points) | shapely.is_empty(points)))
+    coords = shapely.get_coordinates(points[valid])
+
+    # points built from null latitude and longitude never match a segment, keep them out of the table
+    finite = np.isfinite(coords).all(axis=1)
+    valid, coords = valid[finite], coords[finite]
+
+    # incidents are geocoded to the block, so millions of points collapse to a few hundred thousand coordinates
+    uniq, first, inverse = np.unique(np.round(coords, decimals), axis=0, return_index=True, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    keys = pd.DataFrame({'x': uniq[:, 0], 'y': uniq[:, 1], 'key': np.arange(len(uniq))})
+
+    if snap_cache.exists():
+        table = pd.read_parquet(snap_cache)
+    else:
+        table = pd.DataFrame({'x': pd.Series(dtype='float64'), 'y': pd.Series(dtype='float64'),
+                              'segment': pd.Series(dtype='int64'), 'trans_id': pd.Series(dtype='str'),
+                              'distance': pd.Series(dtype='float64')})
+
+    # coordinates with no segment in reach are kept with segment -1 and the radius they were searched with; they, and
+    # coordinates whose nearest segment lies beyond the radius, are known to match nothing within any radius up to that
+    hits = keys.merge(table, on=['x', 'y'], how='inner')
+    reach = np.inf if max_distance is None else max_distance
+    beyond = (hits['segment'] < 0) | (hits['distance'] > reach)
+    known = hits[~beyond | (hits['distance'] >= reach)]
+    hits = hits[~beyond]
+
+    # only coordinates never seen with this street layer, or searched with a smaller radius, go to the spatial query
+    misses = keys[~keys['key'].isin(known['key'])]
+    print(f"{len(keys) - len(misses)} of {len(keys)} coordinates found in the segment lookup table")
+    if len(misses) > 0:
+        # query with the unrounded coordinates of the first point at each key so ties match the plain query
+        m_points = shapely.points(coords[first[misses['key'].values]])
+        m_left, m_right, m_distances = nearest_segments(m_points, tree, max_distance, workers, pool)
+        found = pd.DataFrame({'x': misses['x'].values[m_left], 'y': misses['y'].values[m_left],
+                              'segment': m_right, 'trans_id': street1['trans_id'].values[m_right],
+                              'distance': m_distances})
+        hits = pd.concat([hits, found.assign(key=misses['key'].values[m_left])], ignore_index=True)
+        unmatched = misses[~np.isin(np.arange(len(misses)), m_left)]
+        found = pd.concat([found, pd.DataFrame({'x': unmatched['x'].values, 'y': unmatched['y'].values, 'segment': -1,
+                                                'trans_id': None, 'distance': reach})], ignore_index=True)
+
+        # lookup tables of older street layers no longer apply, nor do the rows of coordinates searched again
+        for stale in snap_cache.parent.glob('snaps_*.parquet'):
+            if stale != snap_cache:
+                stale.unlink()
+        searched = pd.MultiIndex.from_frame(misses[['x', 'y']])
+        table = table[~pd.MultiIndex.from_frame(table[['x', 'y']]).isin(searched)]
+        table = pd.concat([table, found], ignore_index=True)
+        table.to_parquet(snap_cache.with_suffix('.tmp'), index=False)
+        os.replace(snap_cache.with_suffix('.tmp'), snap_cache)
+
+    # expand the matches of each coordinate back onto every point at it, keeping ties in tree order
+    hits = hits.sort_values('key', kind='stable')
+    counts = np.bincount(hits['key'].values, minlength=len(keys))
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    point_counts = counts[inverse]
+    left = np.repeat(valid, point_counts)
+    match = np.repeat(starts[inverse], point_counts) + (np.arange(point_counts.sum()) - np.repeat(np.cumsum(point_counts) - point_counts, point_counts))
+
+    return left, hits['segment'].values[match], hits['distance'].values[match]
+
+
+@measured('snap_to_segments')
+def snap_to_segments(inc1, street1, tree = None, max_distance = None, distance_col = "Distances", workers = 1, snap_cache = None,
+                     pool = None):
+
+    """
+    Assigning incident points to their nearest street segment with the segment index; returns geopandas dataframe like sjoin_nearest.
+    inc1: geopandas dataframe of incident points, same crs as street1
+    street1: street segments with trans_id, street name columns and geometry
+    tree: the STRtree from segment_index, built here when not given
+    max_distance: optional search radius; incidents with no segment within it are dropped
+    distance_col: name of the column holding the distance to the assigned segment
+    workers: number of processes to snap with; more than one needs the forkserver start method
+    snap_cache: optional parquet path of the coordinate lookup table, from snap_cache_path
+    pool: optional process pool from snap_pool, reused across chunks
+    """
+
+    if tree is None:
+        tree = segment_index(street1)
+
+    points = np.asarray(inc1.geometry.values)
+    if snap_cache is not None:
+        left, right, distances = cached_nearest_segments(points, tree, snap_cache, street1, max_distance, workers, pool = pool)
+    else:
+        left, right, distances = nearest_segments(points, tree, max_distance, workers, pool)
+
+    joined = inc1.iloc[left]
+    street_attrs = street1.drop(columns=street1.geometry.name).iloc[right]
+    joined = joined.assign(index_right=street1.index.values[right],
+                           **{col: street_attrs[col].values for col in street_attrs.columns})
+    joined[distance_col] = distances
+
+    return joined
+
+
+@measured('join_segments')
+def join_segments(inc1, com1, street1, tree = None, max_distance = None, workers = 1, snap_cache = None, areas = None, pool = None):
+
+    """
+    Assigning featured incidents to their nearest street segment and their community; returns dataframe of joined incidents.
+    inc1: geopandas dataframe of incidents from incident_features
+    com1: community areas with community_area and community columns
+    street1: street segments with trans_id, street name columns and geometry
+    tree: the STRtree from segment_index, reused across chunks
+    max_distance: optional search radius for the nearest segment
+    workers: number of processes the nearest-segment assignment is spread over
+    snap_cache: optional parquet path of the coordinate to segment lookup table
+    areas: optional list of area lookups from area_lookup, filling the community and beat codes the feed left missing
+    pool: optional process pool from snap_pool, reused across chunks
+    """
+
+    inc_street_join = snap_to_segments(inc1, street1, tree, max_distance, distance_col = "Distances", workers = workers, snap_cache = snap_cache, pool = pool)
+    isj_sub = inc_street_join
+    if areas:
+        isj_sub = assign_areas(isj_sub, areas)
+    # only the community name is joined, boundaries are joined back by community when aggregating
+    isj_sub = pd.merge(isj_sub, pd.DataFrame(com1[['community_area', 'community']]), on='community_area', how = 'left')
+    isj_sub = isj_sub[isj_sub.community.notnull()]
+
+
+
+    # Street-Level Aggregates
+    isj_sub.loc[:, 'gun_arrests'] = isj_sub['is_arrest'] * isj_sub['is_gun']
+    isj_sub.loc[:, 'gun_poss_arrests'] = isj_sub['is_arrest'] * isj_sub['gun_possession']
+    isj_sub.loc[:, 'robbery_arrests'] = isj_sub['is_arrest'] * isj_sub['is_robbery']
+    isj_sub.loc[:, 'violent_arrests'] = isj_sub['is_arrest'] * isj_sub['is_violent']
+    isj_sub.loc[:, 'homicide_arrests'] = isj_sub['is_arrest'] * isj_sub['is_homicide']
+    isj_sub.loc[:, 'agg_assault_arrests'] = isj_sub['is_arrest'] * isj_sub['is_agg_assault']
+    isj_sub.loc[:, 'theft_arrests'] = isj_sub['is_arrest'] * isj_sub['is_theft']
+
+    return isj_sub
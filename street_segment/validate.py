@@ -0,0 +1,98 @@
+"""
+Validation rules checked on the raw incident columns before any geometry is built.
+"""
+import numpy as np
+import pandas as pd
+import shapely
+
+from .config import CITY_BOUNDS, EARLIEST_DATE
+from .metrics import measure
+
+
+def missing_coordinates(inc_df):
+
+    """
+    Finding incidents without a latitude or longitude; returns boolean array, True for the rows breaking the rule.
+    inc_df: pandas dataframe of incidents as parsed from the feed
+    """
+
+    return (inc_df['latitude'].isna() | inc_df['longitude'].isna()).values
+
+
+def outside_city(inc_df):
+
+    """
+    Finding incidents geocoded outside the CITY_BOUNDS rectangle, e.g. CPD's placeholder location; returns boolean array, True for the rows breaking the rule.
+    inc_df: pandas dataframe of incidents as parsed from the feed
+    """
+
+    # a coarse check on the raw coordinates, before any layer is read; points in the suburbs inside the rectangle pass, the
+    # community areas decide later which incidents are in the city
+    lon = inc_df['longitude'].to_numpy(dtype='float64', na_value=np.nan)
+    lat = inc_df['latitude'].to_numpy(dtype='float64', na_value=np.nan)
+
+    # tested on the coordinate arrays, no points are built; missing coordinates are left to their own rule
+    inside = shapely.contains_xy(shapely.Polygon(CITY_BOUNDS), lon, lat)
+
+    return ~inside & ~np.isnan(lon) & ~np.isnan(lat)
+
+
+def duplicate_id(inc_df):
+
+    """
+    Finding incidents listed more than once under the same id; returns boolean array, True for every copy but the last.
+    inc_df: pandas dataframe of incidents as parsed from the feed
+    """
+
+    # one case number can carry several incidents, e.g. a homicide with several victims, so only the id marks a repeat;
+    # the incident store is kept unique by id, this catches repeats within frames read straight from the feed
+    return inc_df.duplicated('id', keep='last').values
+
+
+def date_out_of_range(inc_df):
+
+    """
+    Finding incidents dated before the feed starts or after today; returns boolean array, True for the rows breaking the rule.
+    inc_df: pandas dataframe of incidents as parsed from the feed
+    """
+
+    # incidents without a date are kept, they count towards segment totals
+    dates = inc_df['date']
+    latest = pd.Timestamp.now().normalize() + pd.Timedelta(days=1)
+
+    return (dates.notna() & ((dates < pd.Timestamp(EARLIEST_DATE)) | (dates >= latest))).values
+
+
+# rules every incident has to pass, by the name their counts are reported under
+INCIDENT_RULES = dict(
+    missing_coordinates = missing_coordinates,
+    outside_city = outside_city,
+    duplicate_id = duplicate_id,
+    date_out_of_range = date_out_of_range,
+)
+
+
+def validate_incidents(inc_df, rules = INCIDENT_RULES):
+
+    """
+    Dropping incidents that break any of the rules; returns the valid incidents and the number of rows breaking each rule.
+    inc_df: pandas dataframe of incidents as parsed from the feed
+    rules: dictionary of rule functions by name, each returning True for the rows breaking it
+    """
+
+    with measure('validate_incidents', len(inc_df)) as record:
+        failed = np.zeros(len(inc_df), dtype=bool)
+        counts = {}
+        for name, rule in rules.items():
+            broken = rule(inc_df)
+            counts[name] = int(broken.sum())
+            failed |= broken
+
+        valid = inc_df[~failed]
+        record.update(rows_out = len(valid), rules = counts)
+
+    if failed.any():
+        breakdown = ', '.join(f'{name} {n}' for name, n in counts.items() if n)
+        print(f'{int(failed.sum())} of {len(inc_df)} incidents dropped by validation: {breakdown}')
+
+    return valid, counts
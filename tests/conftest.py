@@ -0,0 +1,206 @@
+"""
+A local stand-in for the SODA csv endpoint of the City of Chicago data portal, so ingestion runs without network access.
+"""
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+
+from street_segment.features import offense_features
+
+# offenses the synthetic incidents are drawn from, covering each flag the features stage sets
+OFFENSES = [
+    ('THEFT', '$500 AND UNDER'),
+    ('ROBBERY', 'ARMED - HANDGUN'),
+    ('BATTERY', 'DOMESTIC BATTERY SIMPLE'),
+    ('WEAPONS VIOLATION', 'UNLAWFUL POSSESSION - HANDGUN'),
+    ('HOMICIDE', 'FIRST DEGREE MURDER'),
+    ('ASSAULT', 'AGGRAVATED - HANDGUN'),
+]
+
+# projected crs of the synthetic layers, metres
+CRS = 'EPSG:26916'
+
+
+def make_incidents(n = 3000, seed = 0, years = (2024, 2025), first_id = 10000000):
+
+    """
+    Drawing synthetic incidents laid out like the crimes feed; returns dataframe with the timestamps as portal strings.
+    n: number of incidents
+    seed: seed of the random draws
+    years: first and last year the incident dates fall in
+    first_id: id of the first incident, the others follow on
+    """
+
+    rng = np.random.default_rng(seed)
+    start, end = pd.Timestamp(f'{years[0]}-01-01'), pd.Timestamp(f'{years[1]}-12-31')
+    dates = start + pd.to_timedelta(rng.integers(0, int((end - start).total_seconds()), n), unit='s')
+    offense = rng.integers(0, len(OFFENSES), n)
+
+    return pd.DataFrame({
+        'id': np.arange(n) + first_id,
+        'case_number': [f'J{first_id + i:08d}' for i in range(n)],
+        'date': dates.strftime('%Y-%m-%dT%H:%M:%S.000'),
+        'iucr': '0820',
+        'primary_type': [OFFENSES[i][0] for i in offense],
+        'description': [OFFENSES[i][1] for i in offense],
+        'arrest': np.where(rng.random(n) < 0.2, 'true', 'false'),
+        'domestic': np.where(rng.random(n) < 0.15, 'true', 'false'),
+        'beat': rng.integers(111, 2535, n),
+        'district': rng.integers(1, 25, n),
+        'ward': rng.integers(1, 50, n),
+        'community_area': rng.integers(1, 77, n),
+        'year': dates.year,
+        'updated_on': (dates + pd.Timedelta(days=7)).strftime('%Y-%m-%dT%H:%M:%S.000'),
+        'x_coordinate': 1160000.0 + rng.integers(0, 300, n) * 140.0,
+        'y_coordinate': 1860000.0 + rng.integers(0, 300, n) * 180.0,
+        'latitude': 41.80013 + rng.integers(0, 20, n) * 0.0075,
+        'longitude': -87.69987 + rng.integers(0, 20, n) * 0.0075,
+    })
+
+
+def make_joined(n = 3000, seed = 0, years = (2024, 2025), n_segments = 150):
+
+    """
+    Standing in for the features and snap stages on synthetic incidents, in the date order the incident store keeps them;
+    returns the joined incidents and the community areas.
+    n: number of incidents
+    seed: seed of the random draws
+    years: first and last year the incident dates fall in
+    n_segments: number of street segments the incidents are spread over
+    """
+
+    rng = np.random.default_rng(seed)
+    inc = make_incidents(n, seed, years)
+    inc['date'] = pd.to_datetime(inc['date'])
+    inc['domestic'] = inc['domestic'] == 'true'
+    for col in ['beat', 'district', 'ward', 'community_area']:
+        inc[col] = inc[col].astype('Int16')
+
+    # a few incidents without a date or a ward, as the feed has them
+    inc.loc[rng.choice(n, n // 100, replace=False), 'date'] = pd.NaT
+    inc.loc[rng.choice(n, n // 10, replace=False), 'ward'] = pd.NA
+    inc = inc.sort_values(['date', 'id'], na_position='last', kind='stable').reset_index(drop=True)
+
+    isj_sub = offense_features(inc)
+    isj_sub['is_arrest'] = (isj_sub['arrest'] == 'true').astype('int8')
+    for col, flag in [('gun_arrests', 'is_gun'), ('gun_poss_arrests', 'gun_possession'), ('robbery_arrests', 'is_robbery'),
+                      ('violent_arrests', 'is_violent'), ('homicide_arrests', 'is_homicide'),
+                      ('agg_assault_arrests', 'is_agg_assault'), ('theft_arrests', 'is_theft')]:
+        isj_sub[col] = isj_sub['is_arrest'] * isj_sub[flag]
+    felony = rng.random(n) < 0.5
+    isj_sub['felony_arrest'] = (isj_sub['is_arrest'] * felony).astype('int8')
+    isj_sub['misdemeanor_arrest'] = (isj_sub['is_arrest'] * ~felony).astype('int8')
+
+    # segments are numbered like the street layer's trans_id, with a street name each
+    segment = rng.integers(0, n_segments, n)
+    isj_sub['trans_id'] = (100 + segment).astype(str)
+    isj_sub['logiclf'] = 100 + segment
+    isj_sub['pre_dir'] = np.where(segment % 2, 'N', 'S')
+    isj_sub['street_nam'] = [f'STREET {i % 40}' for i in segment]
+    isj_sub['street_typ'] = 'AVE'
+
+    com1 = pd.DataFrame({'community_area': np.arange(1, 78, dtype='int16')})
+    com1['community'] = [f'AREA {i:02d}' for i in com1['community_area']]
+    com1['comm_geom'] = [shapely.box(i, 0, i + 1, 1) for i in com1['community_area']]
+    isj_sub = isj_sub.merge(com1, on='community_area', how='left')
+
+    return isj_sub, com1
+
+
+def street_grid(n = 12, block = 100.0):
+
+    """
+    Laying out a grid of one-block street segments; returns geopandas dataframe like the cached street layer.
+    n: number of blocks along each side
+    block: length of a block in metres
+    """
+
+    lines = [shapely.LineString([(i * block, j * block), (i * block, (j + 1) * block)]) for i in range(n + 1) for j in range(n)]
+    lines += [shapely.LineString([(i * block, j * block), ((i + 1) * block, j * block)]) for j in range(n + 1) for i in range(n)]
+
+    return gpd.GeoDataFrame({'trans_id': [str(100 + i) for i in range(len(lines))], 'street_nam': 'GRID'},
+                            geometry=lines, crs=CRS)
+
+
+def where_rows(df, where):
+
+    """
+    Applying a SoQL where clause of timestamp comparisons joined by and; returns the matching rows.
+    df: dataframe of the dataset
+    where: the $where parameter, e.g. "date >= '2024-01-01T00:00:00' and date < '2024-02-01T00:00:00'"
+    """
+
+    keep = np.ones(len(df), dtype=bool)
+    for clause in re.split(r'\s+and\s+', where):
+        col, op, value = re.fullmatch(r"(\w+)\s*(>=|>|<=|<)\s*'([^']+)'", clause.strip()).groups()
+        values, value = pd.to_datetime(df[col]), pd.Timestamp(value)
+        keep &= {'>=': values >= value, '>': values > value, '<=': values <= value, '<': values < value}[op].values
+
+    return df[keep]
+
+
+class SodaHandler(BaseHTTPRequestHandler):
+
+    # the datasets served, by four-by-four identifier
+    datasets = {}
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        # boundary layers are exported whole as geojson
+        match = re.fullmatch(r'/api/views/([\w-]+)/rows\.geojson', url.path)
+        if match and match[1] in self.datasets:
+            self.send_body(self.datasets[match[1]].to_json().encode(), 'application/geo+json')
+            return
+
+        match = re.fullmatch(r'/resource/([\w-]+)\.csv', url.path)
+        if not match or match[1] not in self.datasets:
+            self.send_error(404)
+            return
+
+        # rows come back in id order, as $order=:id gives them
+        df = self.datasets[match[1]].sort_values('id')
+        if '$where' in query:
+            df = where_rows(df, query['$where'])
+        if '$select' in query:
+            df = df[query['$select'].split(',')]
+        offset = int(query.get('$offset', 0))
+        df = df.iloc[offset:offset + int(query.get('$limit', 1000))]
+
+        self.send_body(df.to_csv(index=False).encode(), 'text/csv')
+
+    def send_body(self, body, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def soda():
+
+    """
+    Serving the datasets of SodaHandler on a local port; yields the base url and the dictionary of datasets.
+    """
+
+    SodaHandler.datasets = {}
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SodaHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield f'http://127.0.0.1:{server.server_address[1]}', SodaHandler.datasets
+
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,126 @@
+"""
+Counting synthetic joined incidents through the cube and checking the counts against plain pandas groupbys over the
+incidents, as the aggregate stage counted them before the cube.
+"""
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+import pytest
+
+from street_segment.aggregate import (ROLLUP_LEVELS, SEG_AGG, SEG_TIME_AGG, STREET_AGG, cube_parts, rollup_levels, rollup_segments,
+                                      save_aggregates, segment_attrs, segment_counts, segment_firsts, segment_month_counts, summarize,
+                                      summarize_cube, summarize_neighborhoods, summarize_rates, update_aggregates)
+from street_segment.config import PERIOD_COLUMNS
+from street_segment.frames import covering_months, month_codes, overlapping_periods
+
+from conftest import make_joined
+
+
+def update_joined(isj_sub, k = 6, seed = 1):
+
+    """
+    Moving some incidents back 45 days, changing the offense of some and adding new ones, kept in date order; returns the
+    updated incidents and the months they left or landed in.
+    isj_sub: joined incidents from make_joined
+    k: number of incidents moved and of incidents added
+    seed: seed of the draws
+    """
+
+    updated = isj_sub.copy()
+    idx = updated[updated['date'] >= '2024-03-01'].sample(k, random_state=seed).index
+    left = month_codes(updated.loc[idx, 'date'])
+    updated.loc[idx, 'date'] -= pd.Timedelta(days=45)
+    updated.loc[idx[:k // 2], ['is_violent', 'is_robbery']] = 1
+
+    new, _ = make_joined(k, seed=seed + 10, years=(2025, 2025))
+    new['id'] += 10000000
+    updated = pd.concat([updated, new], ignore_index=True)
+    updated = updated.sort_values(['date', 'id'], na_position='last', kind='stable').reset_index(drop=True)
+    dirty = np.concatenate([left, month_codes(updated.loc[updated['id'].isin(isj_sub.loc[idx, 'id']) | (updated['id'] >= 20000000), 'date'])])
+
+    return updated, np.unique(dirty)
+
+
+def test_segment_counts_match_groupby():
+    isj_sub, _ = make_joined()
+    seg, seg_time = summarize(isj_sub)
+
+    expected = isj_sub.groupby('trans_id').agg(**SEG_AGG).reset_index()
+    pdt.assert_frame_equal(seg[expected.columns], expected, check_dtype=False)
+
+    # incidents without a date only count towards the segment totals
+    dated = isj_sub.assign(**{'year-month': isj_sub['date'].dt.to_period('M').astype(str), 'year': isj_sub['date'].dt.year})
+    expected = dated[isj_sub['date'].notna()].groupby(['trans_id', 'year-month', 'year']).agg(**SEG_TIME_AGG).reset_index()
+    pdt.assert_frame_equal(seg_time[expected.columns], expected, check_dtype=False)
+
+
+def test_street_counts_match_groupby():
+    isj_sub, com1 = make_joined()
+    comm, street_summary = summarize_neighborhoods(isj_sub, com1)
+
+    expected = isj_sub.groupby(['community', 'trans_id']).agg(**STREET_AGG).reset_index()
+    pdt.assert_frame_equal(street_summary[expected.columns], expected, check_dtype=False)
+
+    totals = expected.groupby('community')[['total_incidents', 'violent_incidents', 'total_arrests']].sum().reset_index()
+    totals.insert(1, 'total_streets', expected.groupby('community').size().values)
+    pdt.assert_frame_equal(comm[totals.columns], totals, check_dtype=False)
+
+
+def test_chunked_cube_matches_one_pass():
+    isj_sub, _ = make_joined()
+    seg, seg_time = summarize(isj_sub)
+
+    # the streaming mode counts chunk by chunk and merges the partial cubes
+    parts = [isj_sub.iloc[i:i + 700] for i in range(0, len(isj_sub), 700)]
+    cube, month_first, seg_time_first = cube_parts(parts, compact_every = 2)
+    chunked = summarize_rates(*rollup_segments(cube, segment_firsts(month_first), seg_time_first, segment_attrs(isj_sub)))
+
+    pdt.assert_frame_equal(chunked[0], seg)
+    pdt.assert_frame_equal(chunked[1], seg_time)
+
+
+@pytest.mark.parametrize('period', ['month', 'week', 'quarter'])
+def test_incremental_reaggregation_matches_full_recompute(tmp_path, period):
+    isj_sub, _ = make_joined()
+    cube, month_first, _ = summarize_cube(isj_sub, period)
+    save_aggregates(cube, month_first, 'v1', tmp_path)
+    updated, dirty = update_joined(isj_sub)
+
+    # the months of every period a changed month shares a day with are read back, as the fetch stage does
+    months = covering_months(dirty, period)
+    periods = overlapping_periods(dirty, period)
+    cube, month_first, seg_time_first = summarize_cube(updated[np.isin(month_codes(updated['date']), months)], period)
+    totals, seg_first = update_aggregates(cube, month_first, months, 'v1', tmp_path)
+    street_attrs = segment_attrs(updated)
+    seg = segment_counts(totals, seg_first, street_attrs)
+    seg_time = segment_month_counts(cube, seg_time_first, street_attrs, period, periods)
+
+    full_cube, full_first, full_seg_time_first = summarize_cube(updated, period)
+    full_seg, full_seg_time = rollup_segments(full_cube, segment_firsts(full_first), full_seg_time_first, street_attrs, period)
+    full_seg_time = full_seg_time[full_seg_time['period'].isin(periods)].reset_index(drop=True)
+
+    assert 0 < len(dirty) < 24
+    pdt.assert_frame_equal(seg, full_seg)
+    pdt.assert_frame_equal(seg_time, full_seg_time)
+
+
+@pytest.mark.parametrize('period', ['week', 'month', 'quarter'])
+def test_rollup_levels_match_groupby(period):
+    isj_sub, com1 = make_joined()
+    _, seg_time = summarize(isj_sub, period = period)
+    rollup = rollup_levels(seg_time, com1, period)
+    measures = [name for name, (col, how) in SEG_TIME_AGG.items() if how in ('sum', 'count')]
+    label = PERIOD_COLUMNS[period]
+
+    # each level grouped by the seg_time column naming it, communities by their area number
+    keyed = seg_time.assign(segment = seg_time['trans_id'].astype(int),
+                            community = seg_time['community'].map(dict(zip(com1['community'], com1['community_area']))))
+    for level in ROLLUP_LEVELS:
+        expected = keyed.groupby([level, label], dropna=False)[measures].sum().reset_index().rename(columns={level: 'key'})
+        counts = rollup[rollup['level'] == level].reset_index(drop=True)
+        pdt.assert_frame_equal(counts[expected.columns], expected, check_dtype=False)
+
+    # every level adds up to the same totals by period, segments without a ward or beat included
+    totals = seg_time.groupby(label)[measures].sum()
+    for level in ROLLUP_LEVELS:
+        pdt.assert_frame_equal(rollup[rollup['level'] == level].groupby(label)[measures].sum(), totals)
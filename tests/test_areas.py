@@ -0,0 +1,114 @@
+"""
+Placing incidents and street segments in synthetic areas by point in polygon, checked against geopandas' sjoin, and
+filling the area codes the feed left missing.
+"""
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+import pytest
+import shapely
+
+from street_segment.areas import area_lookup, assign_areas, locate_points
+from street_segment.fetch import import_chi_boundaries
+from street_segment.snap import segment_index, snap_to_segments
+
+from conftest import CRS, street_grid
+
+
+def area_squares(codes = (11, 12, 21, 22), size = 600.0):
+
+    """
+    Laying out square areas two by two over the street grid; returns geopandas dataframe like the boundary layers.
+    codes: area code of each square, row by row
+    size: side of a square in metres
+    """
+
+    squares = [shapely.box(i * size, j * size, (i + 1) * size, (j + 1) * size) for j in range(2) for i in range(2)]
+
+    return gpd.GeoDataFrame({'beat': pd.array(codes, dtype='Int16')}, geometry=squares, crs=CRS)
+
+
+def expected_areas(points, areas):
+
+    """
+    Placing points with geopandas' sjoin, a point on a shared boundary in the first area it touches; returns series of area codes.
+    points: geopandas series of points
+    areas: geopandas dataframe of the areas
+    """
+
+    joined = gpd.GeoDataFrame(geometry=points.reset_index(drop=True)).sjoin(areas, predicate='intersects')
+    first = joined.sort_values('index_right', kind='stable').groupby(level=0)['beat'].first()
+
+    return first.reindex(np.arange(len(points))).astype('Int16')
+
+
+@pytest.fixture
+def incidents():
+    rng = np.random.default_rng(0)
+    xy = rng.uniform(-150, 1350, (2000, 2))
+
+    # corners and edges shared by two or four areas, and points outside every area
+    xy = np.concatenate([xy, [[600, 600], [600, 300], [300, 600], [0, 0], [1200, 1200], [-100, 500], [700, 1300]]])
+
+    beat = pd.array(np.where(rng.random(len(xy)) < 0.6, 111, None), dtype='Int16')
+
+    return gpd.GeoDataFrame({'beat': beat}, geometry=gpd.points_from_xy(xy[:, 0], xy[:, 1]), crs=CRS)
+
+
+def test_points_match_sjoin(incidents):
+    areas = area_squares()
+    codes = locate_points(np.asarray(incidents.geometry.values), shapely.STRtree(areas.geometry.values), areas['beat'].array,
+                          batch_size = 300)
+
+    pdt.assert_series_equal(pd.Series(codes, name='beat'), expected_areas(incidents.geometry, areas))
+
+
+def test_missing_codes_filled(incidents, tmp_path):
+    areas = area_squares()
+    street1 = street_grid()
+    lookup = area_lookup(areas, 'beat', street1, 'grid', cache_dir = tmp_path)
+    isj_sub = snap_to_segments(incidents, street1, segment_index(street1))
+    missing = isj_sub['beat'].isna()
+    filled = assign_areas(isj_sub.copy(), [lookup])
+
+    # codes the feed gave are kept, missing ones come from the point and else from the segment's midpoint
+    midpoints = street1.set_geometry(street1.geometry.interpolate(0.5, normalized=True))
+    segments = pd.Series(expected_areas(midpoints.geometry, areas).values, index=street1['trans_id'])
+    expected = expected_areas(isj_sub.geometry, areas)
+    expected = expected.fillna(isj_sub['trans_id'].map(segments).reset_index(drop=True))
+
+    assert (filled.loc[~missing, 'beat'] == 111).all()
+    pdt.assert_series_equal(filled.loc[missing, 'beat'].reset_index(drop=True), expected[missing.values].reset_index(drop=True))
+    assert filled['beat'].notna().all()
+
+
+def test_segment_areas_cached_by_boundaries(tmp_path):
+    street1 = street_grid()
+    lookup = area_lookup(area_squares(), 'beat', street1, 'grid', cache_dir = tmp_path)
+    cached = area_lookup(area_squares(), 'beat', street1, 'grid', cache_dir = tmp_path)
+
+    assert len(list(tmp_path.glob('beat_grid_*.parquet'))) == 1
+    assert cached['version'] == lookup['version']
+    pdt.assert_series_equal(cached['segments'], lookup['segments'])
+
+    # redrawn boundaries place the segments again rather than read the old placement
+    redrawn = area_lookup(area_squares(codes = (22, 21, 12, 11)), 'beat', street1, 'grid', cache_dir = tmp_path)
+
+    assert redrawn['version'] != lookup['version']
+    assert len(list(tmp_path.glob('beat_grid_*.parquet'))) == 2
+    assert (redrawn['segments'].isin([11, 12, 21, 22])).all()
+    assert (redrawn['segments'] != lookup['segments']).all()
+
+
+def test_boundaries_cached_projected(soda, tmp_path):
+    url, datasets = soda
+    datasets['n9it-hstw'] = area_squares().rename(columns={'beat': 'beat_num'}).to_crs('EPSG:4326')
+
+    for _ in range(2):
+        beats = import_chi_boundaries('beat', url, tmp_path)
+        assert beats.crs == CRS
+        assert np.allclose(beats.total_bounds, [0, 0, 1200, 1200], atol=1e-3)
+
+    with pytest.raises(ValueError):
+        import_chi_boundaries('ward', url, tmp_path)
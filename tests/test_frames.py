@@ -0,0 +1,64 @@
+"""
+Numbering and labelling days, weeks, months, quarters and years on integer day arithmetic, checked against pandas periods.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from street_segment.frames import covering_months, month_codes, overlapping_periods, period_codes, period_labels, period_starts
+
+# pandas period frequency of each period, weeks run monday to sunday
+FREQS = {'day': 'D', 'week': 'W-SUN', 'month': 'M', 'quarter': 'Q', 'year': 'Y'}
+
+
+def sample_dates(n = 5000, seed = 0):
+
+    """
+    Drawing timestamps from 1970 on, with week and year ends, leap days and missing dates among them; returns series of timestamps.
+    n: number of timestamps drawn at random
+    seed: seed of the draws
+    """
+
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp('1970-01-01')
+    dates = start + pd.to_timedelta(rng.integers(0, 58 * 365 * 86400, n), unit='s')
+    edges = pd.DatetimeIndex([pd.Timestamp(date) for date in ['1970-01-01', '1970-01-04 23:59:59', '2020-02-29 23:59:59', '2024-12-30',
+                                                             '2025-01-01', '2026-12-31 23:59:59']])
+
+    return pd.Series(dates.append(edges)).where(rng.random(n + len(edges)) > 0.02)
+
+
+@pytest.mark.parametrize('period', ['day', 'week', 'month', 'quarter', 'year'])
+def test_periods_match_pandas(period):
+    dates = sample_dates()
+    codes = period_codes(dates, period)
+    labels, years = period_labels(codes[codes >= 0], period)
+    periods = dates.dropna().dt.to_period(FREQS[period])
+    starts = periods.dt.start_time
+
+    assert (codes[dates.isna().values] == -1).all()
+    assert (period_starts(codes[codes >= 0], period) == starts.values.astype('datetime64[D]').astype('int64')).all()
+    assert (years == starts.dt.year.values).all()
+    if period in ('day', 'week'):
+        assert (labels == starts.dt.strftime('%Y-%m-%d').values).all()
+    else:
+        assert (labels == periods.astype(str).values).all()
+
+    # codes count periods one by one as pandas ordinals do, weeks from another origin
+    offset = codes[codes >= 0] - periods.array.asi8
+    assert (offset == offset[0]).all()
+
+
+@pytest.mark.parametrize('period', ['day', 'week', 'month', 'quarter', 'year'])
+def test_overlapping_periods_and_covering_months(period):
+    months = np.array([-1, 647, 660, 661, 671])
+    days = pd.Series(pd.date_range('2022-01-01', '2027-12-31'))
+    day_months = month_codes(days)
+    day_periods = period_codes(days, period)
+
+    # the periods sharing a day with the months, and every month of those periods
+    expected = np.unique(day_periods[np.isin(day_months, months)])
+    covered = np.unique(day_months[np.isin(day_periods, expected)])
+
+    assert (overlapping_periods(months, period) == expected).all()
+    assert (covering_months(months, period) == np.r_[-1, covered]).all()
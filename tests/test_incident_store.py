@@ -0,0 +1,166 @@
+"""
+Seeding the incident store, updating it incrementally and seeding it again from scratch against the local SODA stand-in, then
+checking that the store and the aggregates built from it come out the same either way.
+"""
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+
+from street_segment.aggregate import CUBE_MEASURES, save_aggregates, segment_firsts, summarize_cube, update_aggregates
+from street_segment.config import INC_COLUMNS
+from street_segment.features import offense_features
+from street_segment.fetch import (clear_dirty_months, merge_incidents, read_dirty_months, read_incident_months, read_incident_store,
+                                  update_incident_store)
+from street_segment.frames import month_codes
+from street_segment.validate import validate_incidents
+
+from conftest import make_incidents
+
+
+def update_incidents(inc, k = 20):
+
+    """
+    Correcting dates and offenses of some incidents and adding new ones, all updated after the seed; returns the dataframe.
+    inc: incidents the store was seeded from
+    k: number of incidents changed and of incidents added
+    """
+
+    inc = inc.copy()
+
+    # moved back 45 days, so some change month or year; only incidents that stay after the start year
+    idx = inc[inc['date'] >= '2024-03-01'].sample(k, random_state=1).index
+    moved = pd.to_datetime(inc.loc[idx, 'date']) - pd.Timedelta(days=45)
+    inc.loc[idx, 'date'] = moved.dt.strftime('%Y-%m-%dT%H:%M:%S.000')
+    inc.loc[idx, 'year'] = moved.dt.year
+    inc.loc[idx[:k // 2], ['primary_type', 'description']] = ['ROBBERY', 'ARMED - HANDGUN']
+
+    new = make_incidents(k, seed=5, years=(2025, 2025), first_id=20000000)
+    inc = pd.concat([inc, new], ignore_index=True)
+    inc.loc[list(idx) + list(inc.index[-k:]), 'updated_on'] = '2027-01-01T00:00:00.000'
+
+    return inc
+
+
+def joined(inc_df):
+
+    """
+    Standing in for the features and snap stages with offense flags and a grid cell as the segment; returns the joined incidents.
+    inc_df: incidents read from the store
+    """
+
+    isj_sub = offense_features(inc_df)
+    isj_sub['is_arrest'] = isj_sub['arrest'].astype('int8')
+    isj_sub['community'] = isj_sub['community_area'].astype(str)
+    isj_sub['trans_id'] = (isj_sub['latitude'].round(4).astype(str) + ',' + isj_sub['longitude'].round(4).astype(str))
+
+    return isj_sub
+
+
+def seed(url, store_dir):
+
+    """
+    Seeding an empty store from the stand-in; returns the incidents stored.
+    url: base url of the stand-in
+    store_dir: directory of the new incident store
+    """
+
+    update_incident_store(2024, store_dir, url, INC_COLUMNS, concurrency=4)
+
+    return read_incident_store(store_dir, 2024)
+
+
+def test_incremental_update_matches_seed(soda, tmp_path):
+    url, datasets = soda
+    inc = make_incidents()
+    datasets['ijzp-q8t2'] = inc
+    seed(url, tmp_path / 'store')
+    clear_dirty_months(store_dir = tmp_path / 'store')
+    datasets['ijzp-q8t2'] = updated = update_incidents(inc)
+
+    delta = update_incident_store(2024, tmp_path / 'store', url, INC_COLUMNS, concurrency=4)
+    incremental = read_incident_store(tmp_path / 'store', 2024)
+    full = seed(url, tmp_path / 'full')
+
+    # the category order follows the order values were first seen in, which differs between the two
+    assert len(delta) == 40
+    pdt.assert_frame_equal(incremental, full, check_categorical=False)
+
+    # every month an incident left or landed in waits to be re-aggregated
+    changed = updated['updated_on'] == '2027-01-01T00:00:00.000'
+    months = np.concatenate([month_codes(pd.to_datetime(updated.loc[changed, 'date'])),
+                             month_codes(pd.to_datetime(inc.loc[changed[:len(inc)].values, 'date']))])
+    assert set(months) == set(read_dirty_months(tmp_path / 'store'))
+
+
+def test_incremental_aggregates_match_full_recompute(soda, tmp_path):
+    url, datasets = soda
+    inc = make_incidents()
+    datasets['ijzp-q8t2'] = inc
+    cube, month_first, _ = summarize_cube(joined(seed(url, tmp_path / 'store')))
+    save_aggregates(cube, month_first, 'v1', tmp_path / 'aggregates')
+    clear_dirty_months(store_dir = tmp_path / 'store')
+    datasets['ijzp-q8t2'] = update_incidents(inc)
+
+    # only the months the update touched are read back and swapped in
+    update_incident_store(2024, tmp_path / 'store', url, INC_COLUMNS, concurrency=4)
+    months = read_dirty_months(tmp_path / 'store')
+    cube, month_first, _ = summarize_cube(joined(read_incident_months(months, tmp_path / 'store', 2024)))
+    totals, seg_first = update_aggregates(cube, month_first, months, 'v1', tmp_path / 'aggregates')
+
+    cube, month_first, _ = summarize_cube(joined(seed(url, tmp_path / 'full')))
+    full_totals = cube.groupby(['community', 'trans_id'], sort=True, observed=True)[CUBE_MEASURES].sum().reset_index()
+    full_totals = full_totals[(full_totals[CUBE_MEASURES] != 0).any(axis=1)].reset_index(drop=True)
+
+    assert 0 < len(months) < 24
+    pdt.assert_frame_equal(totals, full_totals, check_categorical=False)
+    pdt.assert_frame_equal(seg_first, segment_firsts(month_first), check_categorical=False)
+
+
+def test_store_is_unique_by_id(soda, tmp_path):
+    url, datasets = soda
+    inc = make_incidents(50)
+
+    # victims of one homicide are separate incidents under one case number and time
+    inc.loc[1:3, ['case_number', 'date']] = inc.loc[0, ['case_number', 'date']].values
+    datasets['ijzp-q8t2'] = inc
+    stored = seed(url, tmp_path / 'store')
+
+    assert len(stored) == 50
+    assert len(validate_incidents(stored)[0]) == 50
+
+    # an incident listed twice in one delta is stored once, in its latest version
+    delta = stored.iloc[[5, 5]].copy()
+    delta['ward'] = pd.array([7, 8], dtype='Int16')
+    delta['updated_on'] = pd.to_datetime(['2027-01-01', '2027-01-02'])
+    merge_incidents(delta, tmp_path / 'store')
+    stored = read_incident_store(tmp_path / 'store', 2024)
+
+    assert len(stored) == 50
+    assert stored.loc[stored['id'] == delta['id'].iloc[0], 'ward'].tolist() == [8]
+
+
+def test_dates_corrected_before_start_year_leave_the_store(soda, tmp_path):
+    url, datasets = soda
+    inc = make_incidents()
+    datasets['ijzp-q8t2'] = inc
+    seed(url, tmp_path / 'store')
+    clear_dirty_months(store_dir = tmp_path / 'store')
+
+    # a few incidents re-dated to the year before the store starts
+    updated = inc.copy()
+    idx = updated.sample(5, random_state=7).index
+    updated.loc[idx, 'date'] = '2023-06-15T12:00:00.000'
+    updated.loc[idx, 'year'] = 2023
+    updated.loc[idx, 'updated_on'] = '2027-01-01T00:00:00.000'
+    datasets['ijzp-q8t2'] = updated
+
+    update_incident_store(2024, tmp_path / 'store', url, INC_COLUMNS, concurrency=4)
+    incremental = read_incident_store(tmp_path / 'store', 2024)
+    full = seed(url, tmp_path / 'full')
+
+    assert len(incremental) == len(inc) - 5
+    pdt.assert_frame_equal(incremental, full, check_categorical=False)
+
+    # the months they left are re-aggregated, the month they moved to is never read
+    left = month_codes(pd.to_datetime(inc.loc[idx, 'date']))
+    assert set(read_dirty_months(tmp_path / 'store')) == set(left)
@@ -0,0 +1,80 @@
+"""
+Taking trailing window counts from cumulative sums, in full and after swapping in re-aggregated months, checked against
+pandas rolling sums over the monthly counts.
+"""
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+import pytest
+
+from street_segment.aggregate import ARREST_RATES, summarize_cube
+from street_segment.rolling import (ROLLING_MEASURES, ROLLING_RATES, ROLLING_WINDOWS, cumulative_counts, month_counts, store_months,
+                                    update_cumulative, window_counts, window_months)
+
+from conftest import make_joined
+
+
+def expected_windows(counts):
+
+    """
+    Rolling the monthly counts of each segment with pandas over every month from the first to the last with incidents;
+    returns dataframe laid out as window_counts.
+    counts: counts by trans_id and month from month_counts
+    """
+
+    months = np.arange(counts['month'].min(), counts['month'].max() + 1)
+    dense = counts.set_index(['trans_id', 'month'])[ROLLING_MEASURES].unstack('trans_id', fill_value=0).reindex(months, fill_value=0)
+
+    frame = pd.DataFrame(index=dense.stack('trans_id', future_stack=True).index)
+    for w in ROLLING_WINDOWS:
+        window = dense.rolling(w, min_periods=1).sum().stack('trans_id', future_stack=True).astype('int32')
+        for rate in ROLLING_RATES:
+            arrests, incidents = ARREST_RATES[rate]
+            window[rate] = (window[arrests] / window[incidents]).round(2).fillna(0).astype('float32')
+        frame[[f'{col}_{w}m' for col in ROLLING_MEASURES + ROLLING_RATES]] = window[ROLLING_MEASURES + ROLLING_RATES].values
+
+    # segments without an incident in the longest window are left out
+    frame = frame[frame[f'total_crimes_{max(ROLLING_WINDOWS)}m'] > 0].reset_index()
+    frame['month'] = frame['month'].astype('int32')
+
+    return frame[['trans_id', 'month'] + [col for col in frame.columns if col not in ('trans_id', 'month')]]
+
+
+def sorted_windows(seg_rolling):
+    return seg_rolling.sort_values(['month', 'trans_id']).reset_index(drop=True)
+
+
+def test_windows_match_pandas_rolling():
+    isj_sub, _ = make_joined()
+    counts = month_counts(summarize_cube(isj_sub)[0])
+    seg_rolling = window_counts(cumulative_counts(counts), block_size = 5)
+
+    pdt.assert_frame_equal(sorted_windows(seg_rolling), sorted_windows(expected_windows(counts)), check_dtype=False)
+
+
+@pytest.mark.parametrize('months', [[650, 651, 660], [640, 641, 647], [671, 672, 675], [-1, 648, 671]])
+def test_updated_windows_match_full_recompute(months):
+    isj_sub, _ = make_joined()
+    counts = month_counts(summarize_cube(isj_sub)[0])
+    store = cumulative_counts(counts)
+
+    # the months are counted again from other incidents, some before or after the ones stored
+    rng = np.random.default_rng(months[-1])
+    dated = [m for m in months if m >= 0]
+    fresh = counts.sample(60, random_state=1)[['trans_id'] + ROLLING_MEASURES].copy()
+    fresh['month'] = rng.choice(dated, len(fresh))
+    fresh[ROLLING_MEASURES] = rng.integers(0, 4, (len(fresh), len(ROLLING_MEASURES)))
+    fresh = fresh.groupby(['trans_id', 'month'], as_index=False)[ROLLING_MEASURES].sum()
+    updated = pd.concat([counts[~counts['month'].isin(months)], fresh], ignore_index=True)
+
+    store = update_cumulative(store, fresh, months)
+    seg_rolling = window_counts(store)
+    expected = expected_windows(updated)
+
+    pdt.assert_frame_equal(sorted_windows(seg_rolling), sorted_windows(expected), check_dtype=False)
+
+    # only the months whose windows reach a re-aggregated month are taken again
+    reached = window_months(months, store_months(store))
+    partial = window_counts(store, reached)
+
+    pdt.assert_frame_equal(sorted_windows(partial), sorted_windows(expected[expected['month'].isin(reached)]), check_dtype=False)
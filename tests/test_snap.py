@@ -0,0 +1,96 @@
+"""
+Snapping incidents serially, across the process pool and through the coordinate lookup table, each checked against
+geopandas' sjoin_nearest, ties and search radius included.
+"""
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+import pytest
+
+from street_segment import snap
+from street_segment.snap import segment_index, snap_pool, snap_to_segments
+
+from conftest import CRS, street_grid
+
+
+def incident_points(n = 2000, block = 100.0, seed = 0):
+
+    """
+    Drawing incident points on and around the grid; returns geopandas dataframe of points.
+    n: number of points drawn at random, the ties and far points come on top
+    block: length of a block in metres
+    seed: seed of the random draws
+    """
+
+    rng = np.random.default_rng(seed)
+    xy = rng.uniform(-150, 12 * block + 150, (n, 2))
+
+    # intersections are at distance 0 from up to four segments, block centres equidistant from four
+    ties = np.array([[3 * block, 4 * block], [5.5 * block, 7.5 * block], [0, 0], [2.5 * block, 2 * block]])
+    far = np.array([[-1000.0, -1000.0], [5000.0, 300.0]])
+    xy = np.concatenate([xy, ties, ties, far])
+
+    # a few repeats of one coordinate, as the feed geocodes to the block
+    xy = np.concatenate([xy, np.repeat(xy[:3], 4, axis=0)])
+
+    return gpd.GeoDataFrame({'id': np.arange(len(xy))}, geometry=gpd.points_from_xy(xy[:, 0], xy[:, 1]), crs=CRS)
+
+
+def expected_join(inc1, street1, max_distance = None):
+    return inc1.sjoin_nearest(street1, distance_col='Distances', max_distance=max_distance)
+
+
+@pytest.fixture
+def layers():
+    street1 = street_grid()
+
+    return incident_points(), street1, segment_index(street1)
+
+
+@pytest.mark.parametrize('max_distance', [None, 40.0])
+def test_serial_matches_sjoin_nearest(layers, max_distance):
+    inc1, street1, tree = layers
+    joined = snap_to_segments(inc1, street1, tree, max_distance)
+
+    pdt.assert_frame_equal(joined, expected_join(inc1, street1, max_distance), check_like=True)
+
+
+@pytest.mark.parametrize('max_distance', [None, 40.0])
+def test_parallel_matches_sjoin_nearest(layers, monkeypatch, max_distance):
+    inc1, street1, tree = layers
+    monkeypatch.setattr(snap, 'PARALLEL_MIN_POINTS', 0)
+    with snap_pool(tree, 2) as pool:
+        joined = snap_to_segments(inc1, street1, tree, max_distance, workers = 2, pool = pool)
+
+    pdt.assert_frame_equal(joined, expected_join(inc1, street1, max_distance), check_like=True)
+
+
+def test_cached_matches_sjoin_nearest(layers, monkeypatch, tmp_path):
+    inc1, street1, tree = layers
+    snap_cache = tmp_path / 'snaps.parquet'
+
+    # the first run fills the table, later ones read from it; the search radius changes in between
+    for max_distance in [40.0, 40.0, 25.0, None, 40.0]:
+        joined = snap_to_segments(inc1, street1, tree, max_distance, snap_cache = snap_cache)
+        pdt.assert_frame_equal(joined, expected_join(inc1, street1, max_distance), check_like=True)
+
+    # every coordinate is in the table now, out of reach or not, so nothing is queried again
+    queried = []
+    nearest_segments = snap.nearest_segments
+    monkeypatch.setattr(snap, 'nearest_segments', lambda points, *args: queried.append(len(points)) or nearest_segments(points, *args))
+    snap_to_segments(inc1, street1, tree, 40.0, snap_cache = snap_cache)
+
+    assert queried == []
+
+
+def test_coordinates_out_of_reach_are_stored(layers, tmp_path):
+    inc1, street1, tree = layers
+    snap_cache = tmp_path / 'snaps.parquet'
+    snap_to_segments(inc1, street1, tree, 40.0, snap_cache = snap_cache)
+    table = pd.read_parquet(snap_cache)
+
+    missed = table[table['segment'] < 0]
+    assert len(missed) > 0
+    assert missed['trans_id'].isna().all()
+    assert (missed['distance'] == 40.0).all()